@@ -25,6 +25,7 @@ setup(
     ],
     extras_require={
         'testing': ['pytest'],
+        'batch': ['numpy'],
     },
     test_suite='stratatools',
     entry_points={
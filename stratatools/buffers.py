@@ -0,0 +1,92 @@
+#
+# See the LICENSE file
+#
+
+import contextlib
+import sys
+
+#
+# Buffers of the data path
+#
+# The manager, crypto and checksum read and write bytes, bytearray and
+# memoryview alike. These helpers give an integer indexable view of a buffer
+# without copying it where the interpreter allows, Python 2 memoryviews index
+# as characters and are copied.
+#
+
+PY2 = sys.version_info[0] == 2
+
+def byte_view(data):
+    if isinstance(data, bytearray):
+        return data
+    if PY2:
+        return bytearray(data)
+
+    view = memoryview(data)
+    if view.format != "B" or view.ndim != 1:
+        view = view.cast("B")
+    return view
+
+def to_bytes(data):
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return bytes(data)
+
+#
+# List the (start, end) ranges where new differs from old
+#
+def diff_ranges(old, new):
+    ranges = []
+    start = None
+
+    for i in range(len(new)):
+        changed = i >= len(old) or old[i] != new[i]
+        if changed and start is None:
+            start = i
+        elif not changed and start is not None:
+            ranges.append((start, i))
+            start = None
+
+    if start is not None:
+        ranges.append((start, len(new)))
+
+    return ranges
+
+# Size of the EEPROM of a cartridge
+EEPROM_SIZE = 512
+
+#
+# Pool of preallocated buffers of the same size
+#
+# Long running processes take a buffer with acquire() and give it back with
+# release() once done, so the steady state does not allocate. Buffers are
+# not cleared on release. At most max_free buffers are kept, more are left
+# to the garbage collector.
+#
+class Buffer_Pool:
+    def __init__(self, size=EEPROM_SIZE, preallocate=0, max_free=64):
+        self.size = size
+        self.max_free = max_free
+        self.free = [bytearray(size) for i in range(preallocate)]
+        self.allocated = preallocate
+
+    def acquire(self):
+        try:
+            return self.free.pop()
+        except IndexError:
+            self.allocated += 1
+            return bytearray(self.size)
+
+    def release(self, buffer):
+        if len(buffer) != self.size:
+            raise Exception("buffer size must be " + str(self.size) + ", got " + str(len(buffer)))
+        if len(self.free) < self.max_free:
+            self.free.append(buffer)
+
+    @contextlib.contextmanager
+    def buffer(self):
+        buffer = self.acquire()
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
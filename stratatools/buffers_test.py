@@ -0,0 +1,35 @@
+import unittest
+from stratatools import buffers
+from stratatools.buffers import Buffer_Pool
+
+class TestBuffers(unittest.TestCase):
+    def test_diff_ranges(self):
+        assert buffers.diff_ranges(bytearray(b"abcdef"), bytearray(b"abcdef")) == []
+        assert buffers.diff_ranges(bytearray(b"abcdef"), bytearray(b"xbcdyyz")) == [(0, 1), (4, 7)]
+
+    def test_byte_view(self):
+        data = bytearray(b"\x01\x02\x03\x04")
+
+        assert buffers.byte_view(data) is data
+        assert list(buffers.byte_view(memoryview(data)[1:3])) == [2, 3]
+        assert list(buffers.byte_view(b"\x05\x06")) == [5, 6]
+        assert buffers.to_bytes(memoryview(data)[0:2]) == b"\x01\x02"
+
+    def test_pool(self):
+        pool = Buffer_Pool(size=16, max_free=1)
+
+        a = pool.acquire()
+        b = pool.acquire()
+        assert len(a) == 16 and a is not b
+        assert pool.allocated == 2
+
+        pool.release(a)
+        pool.release(b)
+        assert len(pool.free) == 1
+        assert pool.acquire() is a
+
+        self.assertRaises(Exception, pool.release, bytearray(8))
+
+        with pool.buffer() as c:
+            assert len(c) == 16
+        assert pool.free == [c]
@@ -1,18 +1,105 @@
+import binascii
 import datetime
 import random
 
+from stratatools import cartridge_pb2
+from stratatools import layout
+
+#
+# Native cartridge record, used by the manager
+#
+# Values are kept the way they are stored on the EEPROM: dates are packed
+# integers (see layout.pack_date) and the key fragment is raw bytes. The
+# protobuf message is only used at the CLI and file boundaries, through
+# to_proto() and from_proto().
+#
+class Cartridge_Record(object):
+    __slots__ = ("serial_number", "material_name", "manufacturing_lot",
+                 "manufacturing_date", "last_use_date", "initial_material_quantity",
+                 "current_material_quantity", "key_fragment", "version", "signature")
+
+    def __init__(self, **values):
+        self.serial_number = 0.0
+        self.material_name = ""
+        self.manufacturing_lot = ""
+        self.manufacturing_date = EPOCH
+        self.last_use_date = EPOCH
+        self.initial_material_quantity = 0.0
+        self.current_material_quantity = 0.0
+        self.key_fragment = b"\x00" * 8
+        self.version = 0
+        self.signature = ""
+
+        for (name, value) in values.items():
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, Cartridge_Record):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return "Cartridge_Record(" + ", ".join(name + "=" + repr(value) for (name, value) in zip(self.__slots__, self.values())) + ")"
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def to_proto(self):
+        c = cartridge_pb2.Cartridge()
+        c.serial_number = self.serial_number
+        c.material_name = self.material_name
+        c.manufacturing_lot = self.manufacturing_lot
+        c.manufacturing_date.FromDatetime(layout.unpack_date(self.manufacturing_date))
+        c.last_use_date.FromDatetime(layout.unpack_date(self.last_use_date))
+        c.initial_material_quantity = self.initial_material_quantity
+        c.current_material_quantity = self.current_material_quantity
+        c.key_fragment = binascii.hexlify(self.key_fragment)
+        c.version = self.version
+        c.signature = self.signature
+        return c
+
+    @classmethod
+    def from_proto(cls, c):
+        record = cls.__new__(cls)
+        record.serial_number = c.serial_number
+        record.material_name = c.material_name
+        record.manufacturing_lot = c.manufacturing_lot
+        record.manufacturing_date = layout.pack_date(c.manufacturing_date.ToDatetime())
+        record.last_use_date = layout.pack_date(c.last_use_date.ToDatetime())
+        record.initial_material_quantity = c.initial_material_quantity
+        record.current_material_quantity = c.current_material_quantity
+        record.key_fragment = binascii.unhexlify(c.key_fragment)
+        record.version = c.version
+        record.signature = c.signature
+        return record
+
+EPOCH = layout.pack_date(datetime.datetime(1970, 1, 1))
+
 def get_random_serialnumber():
     random.seed()
     return float(random.randint(1, 2**8))
 
-# Refill the provided cartridge
+# Fields changed by a refill, suitable for Manager.patch
+def refill_fields(initial_material_quantity):
+    now = layout.pack_date(datetime.datetime.now())
+    return {
+        "current_material_quantity": initial_material_quantity,
+        "last_use_date": now,
+        "manufacturing_date": now,
+        "serial_number": get_random_serialnumber(),
+    }
+
+# Refill the provided cartridge record
 def refill(cartridge):
     cartridge.current_material_quantity = cartridge.initial_material_quantity
-    cartridge.last_use_date.FromDatetime(datetime.datetime.now())
-    cartridge.manufacturing_date.FromDatetime(datetime.datetime.now())
+    cartridge.last_use_date = layout.pack_date(datetime.datetime.now())
+    cartridge.manufacturing_date = cartridge.last_use_date
     cartridge.serial_number = get_random_serialnumber()
 
     return cartridge
-
-
-
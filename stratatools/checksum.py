@@ -4,6 +4,13 @@
 
 import binascii
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from stratatools import buffers
+
 class Checksum:
     def __init__(self):
         pass
@@ -11,8 +18,30 @@ class Checksum:
     def checksum(self):
         pass
 
+#
+# Incremental checksum, fed with update() as data arrives
+#
+class Crc16_State:
+    def __init__(self, checksum, crc=0):
+        self.checksum = checksum
+        self.crc = crc
+        self.length = 0
+
+    def update(self, chunk):
+        self.crc = self.checksum.checksum(chunk, self.crc)
+        self.length += len(chunk)
+        return self
+
+    def value(self):
+        return self.crc
+
+    def copy(self):
+        state = Crc16_State(self.checksum, self.crc)
+        state.length = self.length
+        return state
+
 class Crc16_Checksum(Checksum):
-    def __init__(self):
+    def __init__(self, slice_by=8):
         self.table = [
             0x0000, 0xC0C1, 0xC181, 0x0140, 0xC301, 0x03C0, 0x0280, 0xC241,
             0xC601, 0x06C0, 0x0780, 0xC741, 0x0500, 0xC5C1, 0xC481, 0x0440,
@@ -47,8 +76,132 @@ class Crc16_Checksum(Checksum):
             0x4400, 0x84C1, 0x8581, 0x4540, 0x8701, 0x47C0, 0x4680, 0x8641,
             0x8201, 0x42C0, 0x4380, 0x8341, 0x4100, 0x81C1, 0x8081, 0x4040]
 
-    def checksum(self, data, crc=0):
+        self.table_array = None
+
+        if slice_by not in (1, 4, 8):
+            raise Exception("slice_by must be 1, 4 or 8")
+        self.slice_by = slice_by
+
+        # tables[k][x] is the checksum of byte x followed by k zero bytes
+        self.tables = [self.table]
+        for k in range(1, 8):
+            previous = self.tables[k-1]
+            self.tables.append([(previous[x] >> 8) ^ self.table[previous[x] & 0xff] for x in range(256)])
+
+        # zero_operators[k] maps a checksum to the checksum of itself followed
+        # by 2^k zero bytes, as the image of each of its 16 bits
+        self.zero_operators = [[self._checksum_bytes(bytearray(1), 1 << i) for i in range(16)]]
+
+    def _checksum_bytes(self, data, crc=0):
         for byte in data:
             crc = self.table[(crc ^ byte) & 0xff] ^ (crc >> 8) & 0xffff
         return crc
 
+    def _checksum_slice4(self, data, crc):
+        (t0, t1, t2, t3) = self.tables[0:4]
+        end = len(data) - len(data) % 4
+        for i in range(0, end, 4):
+            crc ^= data[i] | (data[i+1] << 8)
+            crc = t3[crc & 0xff] ^ t2[crc >> 8] ^ t1[data[i+2]] ^ t0[data[i+3]]
+        return self._checksum_bytes(data[end:], crc)
+
+    def _checksum_slice8(self, data, crc):
+        (t0, t1, t2, t3, t4, t5, t6, t7) = self.tables
+        end = len(data) - len(data) % 8
+        for i in range(0, end, 8):
+            crc ^= data[i] | (data[i+1] << 8)
+            crc = (t7[crc & 0xff] ^ t6[crc >> 8] ^ t5[data[i+2]] ^ t4[data[i+3]] ^
+                   t3[data[i+4]] ^ t2[data[i+5]] ^ t1[data[i+6]] ^ t0[data[i+7]])
+        return self._checksum_bytes(data[end:], crc)
+
+    #
+    # data may be bytes, a bytearray or a memoryview, it is read in place
+    #
+    def checksum(self, data, crc=0):
+        data = buffers.byte_view(data)
+
+        if self.slice_by == 8:
+            return self._checksum_slice8(data, crc)
+        elif self.slice_by == 4:
+            return self._checksum_slice4(data, crc)
+        return self._checksum_bytes(data, crc)
+
+    def new_state(self, crc=0):
+        return Crc16_State(self, crc)
+
+    def _apply_operator(self, operator, crc):
+        result = 0
+        i = 0
+        while crc:
+            if crc & 1:
+                result ^= operator[i]
+            crc >>= 1
+            i += 1
+        return result
+
+    #
+    # Checksum of the data followed by length zero bytes, given the checksum
+    # of the data, in O(log(length))
+    #
+    def shift(self, crc, length):
+        k = 0
+        while length:
+            if k == len(self.zero_operators):
+                operator = self.zero_operators[k-1]
+                self.zero_operators.append([self._apply_operator(operator, operator[i]) for i in range(16)])
+            if length & 1:
+                crc = self._apply_operator(self.zero_operators[k], crc)
+            length >>= 1
+            k += 1
+        return crc
+
+    #
+    # Checksum of A followed by B from the checksums of A and B
+    #
+    def combine(self, crc_a, crc_b, length_b):
+        return self.shift(crc_a, length_b) ^ crc_b
+
+    #
+    # Update the checksum of a region after replacing old by new, followed by
+    # trailing_length bytes up to the end of the region, without reading the
+    # rest of the region
+    #
+    def patch(self, crc, old, new, trailing_length):
+        if len(old) != len(new):
+            raise Exception("patched data must keep the same length")
+
+        difference = bytearray(a ^ b for (a, b) in zip(buffers.byte_view(old), buffers.byte_view(new)))
+        return crc ^ self.shift(self._checksum_bytes(difference), trailing_length)
+
+    #
+    # Checksum N buffers of the same length in lockstep, one byte position at
+    # a time over all of them
+    #
+    # data is a (N, length) uint8 array or a sequence of N buffers, returns
+    # the N checksums as an uint16 array
+    #
+    def checksum_batch(self, data, crc=0):
+        if numpy is None:
+            raise Exception("numpy is required for batch checksum")
+
+        if self.table_array is None:
+            self.table_array = numpy.array(self.table, dtype=numpy.uint16)
+
+        if not isinstance(data, numpy.ndarray):
+            data = [buffers.to_bytes(buf) for buf in data]
+            if not data:
+                return numpy.empty(0, dtype=numpy.uint16)
+            if len(set(len(buf) for buf in data)) > 1:
+                raise Exception("all buffers must have the same length")
+            data = numpy.frombuffer(b"".join(data), dtype=numpy.uint8).reshape(len(data), -1)
+
+        if data.ndim != 2:
+            raise Exception("expected a (N, length) array, got shape " + str(data.shape))
+
+        crcs = numpy.empty(len(data), dtype=numpy.uint16)
+        crcs[:] = crc
+        for column in numpy.asarray(data, dtype=numpy.uint8).T:
+            crcs = self.table_array[(crcs ^ column) & 0xff] ^ (crcs >> 8)
+
+        return crcs
+
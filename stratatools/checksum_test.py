@@ -1,11 +1,87 @@
+import os
 import unittest
 from stratatools import checksum
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class TestCrc16(unittest.TestCase):
     def test_checksum(self):
         expected_crc16 = 14743
 
         crc = checksum.Crc16_Checksum()
-        crc16 = crc.checksum(bytearray("abcd"))
+        crc16 = crc.checksum(bytearray(b"abcd"))
 
         assert expected_crc16 == crc16
+
+    def test_checksum_slice_by(self):
+        for length in [0, 1, 3, 4, 7, 8, 9, 64, 113]:
+            data = bytearray(os.urandom(length))
+            expected_crc16 = checksum.Crc16_Checksum(slice_by=1).checksum(data)
+
+            assert expected_crc16 == checksum.Crc16_Checksum(slice_by=4).checksum(data)
+            assert expected_crc16 == checksum.Crc16_Checksum(slice_by=8).checksum(data)
+
+    def test_checksum_memoryview(self):
+        crc = checksum.Crc16_Checksum()
+        data = bytearray(os.urandom(113))
+
+        assert crc.checksum(data[0x00:0x40]) == crc.checksum(memoryview(data)[0x00:0x40])
+        assert crc.checksum(data) == crc.checksum(bytes(data))
+
+    def test_checksum_state(self):
+        crc = checksum.Crc16_Checksum()
+
+        state = crc.new_state()
+        state.update(bytearray(b"ab")).update(bytearray(b"cd"))
+
+        assert 14743 == state.value()
+        assert 4 == state.length
+
+    def test_checksum_combine(self):
+        crc = checksum.Crc16_Checksum()
+        a = bytearray(os.urandom(64))
+        b = bytearray(os.urandom(1000))
+
+        assert crc.checksum(a + b) == crc.combine(crc.checksum(a), crc.checksum(b), len(b))
+        assert crc.checksum(a) == crc.combine(crc.checksum(a), 0, 0)
+
+    def test_checksum_patch(self):
+        crc = checksum.Crc16_Checksum()
+        old = bytearray(os.urandom(64))
+        new = bytearray(old)
+        new[0x38:0x40] = os.urandom(8)
+
+        assert crc.checksum(new) == crc.patch(crc.checksum(old), old[0x38:0x40], new[0x38:0x40], 0)
+
+        old = bytearray(new)
+        new[0x08:0x10] = os.urandom(8)
+
+        assert crc.checksum(new) == crc.patch(crc.checksum(old), old[0x08:0x10], new[0x08:0x10], 0x30)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_checksum_batch(self):
+        crc = checksum.Crc16_Checksum()
+
+        data = numpy.frombuffer(os.urandom(100 * 64), dtype=numpy.uint8).reshape(100, 64)
+        crc16s = crc.checksum_batch(data)
+
+        assert len(crc16s) == 100
+        for i in range(len(data)):
+            assert crc.checksum(bytearray(data[i].tobytes())) == crc16s[i]
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_checksum_batch_buffers(self):
+        crc = checksum.Crc16_Checksum()
+
+        assert list(crc.checksum_batch([bytearray(b"abcd"), b"abcd"])) == [14743, 14743]
+        self.assertRaises(Exception, crc.checksum_batch, [b"abcd", b"abc"])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_checksum_batch_empty(self):
+        crc = checksum.Crc16_Checksum()
+
+        assert len(crc.checksum_batch([])) == 0
+        assert len(crc.checksum_batch(numpy.zeros((0, 64), dtype=numpy.uint8))) == 0
@@ -6,6 +6,7 @@
 
 import argparse
 import binascii
+import csv
 from datetime import datetime
 import struct
 import sys
@@ -13,18 +14,20 @@ import sys
 from google.protobuf.text_format import MessageToString, Merge
 
 from stratatools import cartridge_pb2
+from stratatools.cartridge import Cartridge_Record
 from stratatools import checksum
 from stratatools import crypto
 from stratatools import machine
 from stratatools import manager
 from stratatools import material
-from stratatools.formatter import DiagnosticPort_Formatter
+from stratatools.formatter import Ascii_Formatter, DiagnosticPort_Formatter
 from stratatools.setupcode import *
 
 class StratatoolsConsoleApp():
     def __init__(self):
         self.argparse = self.build_argparser()
         self.diag_formatter = DiagnosticPort_Formatter()
+        self.ascii_formatter = Ascii_Formatter()
 
     def run(self):
         args = self.argparse.parse_args()
@@ -44,6 +47,7 @@ class StratatoolsConsoleApp():
         eeprom_encode.add_argument("-e", "--eeprom-uid", action="store", dest="eeprom_uid", required=True, help="Format: [a-f0-9]{14}23, example: 11010a01ba325d23")
         eeprom_encode.add_argument("-D", "--diag-format", action="store_true", dest="diag_format", help="Produce output in the ASCII format used over the printer diagnostic port")
         eeprom_encode.add_argument("-a", "--use-ascii", action="store_true", dest="use_ascii", help="Use ASCII format for output file")
+        eeprom_encode.add_argument("--diag-old", action="store", dest="diag_old", type=argparse.FileType('r'), help="With -D, 'er' dump of the current EEPROM, only the changed bytes are written as 'ew' commands")
         eeprom_encode.add_argument('input_file', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
         eeprom_encode.add_argument('output_file', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
         eeprom_encode.set_defaults(func=self.command_eeprom_encode)
@@ -53,10 +57,19 @@ class StratatoolsConsoleApp():
         eeprom_decode.add_argument("-t", "--machine-type", action="store", choices=machine.get_machine_types(), help="Machine type (Fox T-class, Prodigy P-class, Quantum, uPrint, uPrint SE)", required=True)
         eeprom_decode.add_argument("-e", "--eeprom-uid", action="store", dest="eeprom_uid", required=True, help="Format: [a-f0-9]{14}23, example: 11010a01ba325d23")
         eeprom_decode.add_argument("-D", "--diag-format", action="store_true", dest="diag_format", help="Read input in the ASCII format used over the printer diagnostic port")
+        eeprom_decode.add_argument("-a", "--use-ascii", action="store_true", dest="use_ascii", help="Read input in the ASCII format produced by eeprom_encode -a")
         eeprom_decode.add_argument('input_file', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
         eeprom_decode.add_argument('output_file', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
         eeprom_decode.set_defaults(func=self.command_eeprom_decode)
 
+        # EEPROM probe options
+        eeprom_probe = subparsers.add_parser("eeprom_probe", help="EEPROM - find the machine type and eeprom uid of a binary dump")
+        eeprom_probe.add_argument("-e", "--eeprom-uid", action="store", dest="eeprom_uid", required=True, help="Format: [a-f0-9]{14}23, example: 11010a01ba325d23, the other family code and byte order are tried as well")
+        eeprom_probe.add_argument("-D", "--diag-format", action="store_true", dest="diag_format", help="Read input in the ASCII format used over the printer diagnostic port")
+        eeprom_probe.add_argument('input_file', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
+        eeprom_probe.add_argument('output_file', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
+        eeprom_probe.set_defaults(func=self.command_eeprom_probe)
+
         # EEPROM create options
         eeprom_create = subparsers.add_parser("eeprom_create", help="EEPROM - create a cartridge")
         eeprom_create.add_argument("-m", "--material-name", action="store", type=str, dest="material_name", help="Run \"stratatools-cli.py material --list\" for a list of known material")
@@ -85,6 +98,20 @@ class StratatoolsConsoleApp():
         setupcode_create.add_argument("-k", "--key", action="store", dest="key", type=int, default=0)
         setupcode_create.set_defaults(func=self.command_setupcode_create)
 
+        # SetupCode batch options
+        setupcode_batch = subparsers.add_parser("setupcode_batch", help="SetupCode - create setup codes from CSV rows")
+        setupcode_batch.add_argument("-t", "--type", action="store", dest="code_type", choices=CodeType.all(), default="configuration")
+        setupcode_batch.add_argument("-j", "--jobs", action="store", dest="jobs", type=int, default=None, help="Number of processes, one per CPU by default")
+        setupcode_batch.add_argument('input_file', nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="Rows of serial_number,system_type,envelope_size,build_speed,materials,version[,key]")
+        setupcode_batch.add_argument('output_file', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
+        setupcode_batch.set_defaults(func=self.command_setupcode_batch)
+
+        # SetupCode batch decode options
+        setupcode_decode_batch = subparsers.add_parser("setupcode_decode_batch", help="SetupCode - check and decode setup codes, one per line")
+        setupcode_decode_batch.add_argument('input_file', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
+        setupcode_decode_batch.add_argument('output_file', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
+        setupcode_decode_batch.set_defaults(func=self.command_setupcode_decode_batch)
+
         # SetupCode decode options
         setupcode_decode = subparsers.add_parser("setupcode_decode", help="SetupCode - print information about a setup code")
         setupcode_decode.add_argument("setup_code", action="store")
@@ -108,12 +135,16 @@ class StratatoolsConsoleApp():
         machine_number = machine.get_number_from_type(args.machine_type)
 
         m = manager.Manager(crypto.Desx_Crypto(), checksum.Crc16_Checksum())
-        eeprom = m.encode(machine_number, args.eeprom_uid.decode("hex"), cartridge)
+        eeprom = m.encode(machine_number, args.eeprom_uid.decode("hex"), Cartridge_Record.from_proto(cartridge))
 
         if args.use_ascii:
-            eeprom = self._make_ascii(cartridge, eeprom, args.eeprom_uid, args.machine_number)
+            eeprom = self._make_ascii(cartridge, eeprom, args.eeprom_uid, machine_number)
 
-        if args.diag_format:
+        if args.diag_format and args.diag_old:
+            old = self.diag_formatter.from_file(args.diag_old)
+            commands = self.diag_formatter.plan_commands(old[0:len(eeprom)], eeprom)
+            eeprom = self.diag_formatter.format_commands(commands)
+        elif args.diag_format:
             eeprom = self.diag_formatter.to_destination(eeprom)
 
         args.output_file.write(eeprom)
@@ -121,16 +152,38 @@ class StratatoolsConsoleApp():
         return
 
     def command_eeprom_decode(self, args):
-        cartridge_crypted = args.input_file.read()
-
         if args.diag_format:
-            cartridge_crypted = self.diag_formatter.from_source(cartridge_crypted)
+            cartridge_crypted = self.diag_formatter.from_file(args.input_file)
+        elif args.use_ascii:
+            cartridge_crypted = self.ascii_formatter.from_source(args.input_file.read())
+        else:
+            cartridge_crypted = args.input_file.read()
 
         m = manager.Manager(crypto.Desx_Crypto(), checksum.Crc16_Checksum())
         machine_number = machine.get_number_from_type(args.machine_type)
         cartridge = m.decode(machine_number, args.eeprom_uid.decode("hex"), bytearray(cartridge_crypted))
 
-        args.output_file.write((MessageToString(cartridge)))
+        args.output_file.write((MessageToString(cartridge.to_proto())))
+
+        return
+
+    def command_eeprom_probe(self, args):
+        if args.diag_format:
+            cartridge_crypted = self.diag_formatter.from_file(args.input_file)
+        else:
+            cartridge_crypted = args.input_file.read()
+
+        m = manager.Manager(crypto.Desx_Crypto(), checksum.Crc16_Checksum())
+        machines = [(known.type, known.number) for known in machine.get_machines()]
+        result = m.probe(args.eeprom_uid.decode("hex"), bytearray(cartridge_crypted), machines)
+
+        if result.machine_type is None:
+            args.output_file.write("no machine type and eeprom uid matched, tried " + str(result.tried) + " candidates in %.3fs\n" % result.elapsed)
+            return
+
+        args.output_file.write("machine type: " + result.machine_type + "\n")
+        args.output_file.write("eeprom uid: " + binascii.hexlify(result.eeprom_uid) + "\n")
+        args.output_file.write("matched after " + str(result.tried) + " candidates in %.3fs\n" % result.elapsed)
 
         return
 
@@ -161,32 +214,16 @@ class StratatoolsConsoleApp():
             self._material_list(args)
 
     def _make_ascii(self, cartridge, eeprom_bin, eeprom_uid, machine_number):
-        lines = MessageToString(cartridge)
-
-        # Prefix each line with comment `#`
-        s = ""
-        for l in lines:
-            s += "# " + l + "\n"
-
-        s += "# eeprom uid: " + eeprom_uid + "\n"
-        s += "# machine number: " + machine_number + "\n"
-        s += "#\n"
-
-        # turn to binary into 32 chars wide ascii lines
-        eeprom_ascii = binascii.b2a_hex(eeprom_bin)
-        n = len(eeprom_ascii)
-        for i in range(0, n, 32):
-            nn = 32
-            if (n - i) < 32: nn = n - i
-            s += eeprom_ascii[i : i + nn] + '\n'
+        comments = MessageToString(cartridge).splitlines()
+        comments.append("eeprom uid: " + eeprom_uid)
+        comments.append("machine number: " + binascii.hexlify(machine_number))
+        comments.append("")
 
-        return s
+        return self.ascii_formatter.to_destination(eeprom_bin, comments)
 
     def _material_list(self, args):
-        for k in range(len(material.id_to_name)):
-            m = material.id_to_name[k]
-            if m != "unknown":
-                print(str(k) + "\t" + m)
+        for (k, m) in material.get_materials():
+            print(str(k) + "\t" + m)
 
     def command_setupcode_create(self, args):
         encoder = SetupcodeEncoder()
@@ -194,6 +231,30 @@ class StratatoolsConsoleApp():
 
         print(s)
 
+    def command_setupcode_batch(self, args):
+        writer = csv.writer(args.output_file, lineterminator="\n")
+
+        for result in encode_batch(read_setupcode_rows(args.input_file), args.code_type, processes=args.jobs):
+            serial_number = result.row.serial_number if result.row is not None else ""
+            writer.writerow([serial_number, result.code or "", result.error or ""])
+
+    def command_setupcode_decode_batch(self, args):
+        setup_codes = [line.strip() for line in args.input_file if line.strip() and not line.startswith("#")]
+
+        encoder = SetupcodeEncoder()
+        batch = encoder.decode_batch(setup_codes)
+        writer = csv.writer(args.output_file, lineterminator="\n")
+
+        writer.writerow(["setup_code", "status", "serial_number", "system_type", "envelope_size", "build_speed", "version", "code_type", "material", "key"])
+        for (i, setup_code) in enumerate(setup_codes):
+            status = decode_status_names[batch.status[i]]
+            if batch.status[i] != DECODE_OK:
+                writer.writerow([setup_code, status])
+                continue
+
+            s = encoder.batch_setupcode(batch, i)
+            writer.writerow([setup_code, status, s.serial_number, s.system_type, s.envelope_size, s.build_speed, s.version, s.code_type, s.material.strip(), s.key])
+
     def command_setupcode_decode(self, args):
         encoder = SetupcodeEncoder()
         s = encoder.decode(args.setup_code)
@@ -3,21 +3,256 @@
 #
 
 import binascii
-from Crypto.Cipher import DES
-from Crypto.Util.strxor import strxor
+import collections
+import json
+import os
+import platform
+import timeit
+
+try:
+    from Crypto.Cipher import DES
+    from Crypto.Util.strxor import strxor
+except ImportError:
+    DES = None
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import Cipher, modes
+    try:
+        from cryptography.hazmat.decrepit.ciphers.algorithms import TripleDES
+    except ImportError:
+        from cryptography.hazmat.primitives.ciphers.algorithms import TripleDES
+except ImportError:
+    Cipher = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from stratatools import buffers
+from stratatools import des
+
+#
+# DES backends
+#
+# A backend provides DES in ECB mode and a xor of two buffers, both writing
+# their result into an output bytearray or memoryview. The fastest available backend is
+# picked by a short benchmark, run once then cached on disk. The choice can
+# be forced with the STRATATOOLS_CRYPTO_BACKEND environment variable.
+#
+
+BACKEND_ENVIRONMENT_VARIABLE = "STRATATOOLS_CRYPTO_BACKEND"
+
+backends = collections.OrderedDict()
+
+def register_backend(backend_class):
+    backends[backend_class.name] = backend_class
+    return backend_class
+
+class Backend():
+    name = None
 
-class Crypto():
     def __init__(self):
         pass
 
+    @staticmethod
+    def is_available():
+        return False
+
+    #
+    # Returns an object with encrypt(data, output) and decrypt(data, output)
+    #
+    def new_des(self, key):
+        raise Exception("this class cannot be used")
+
+    #
+    # Xor both buffers as big integers
+    #
+    def xor(self, a, b, output):
+        if len(output) == 0:
+            return
+        value = int(binascii.hexlify(a), 16) ^ int(binascii.hexlify(b), 16)
+        output[:] = binascii.unhexlify("%0*x" % (len(output) * 2, value))
+
+@register_backend
+class Pycryptodome_Backend(Backend):
+    name = "pycryptodome"
+
+    @staticmethod
+    def is_available():
+        return DES is not None
+
+    def new_des(self, key):
+        return DES.new(bytes(key), DES.MODE_ECB)
+
+    def xor(self, a, b, output):
+        strxor(a, b, output=output)
+
+class Cryptography_Des():
+    def __init__(self, key):
+        cipher = Cipher(TripleDES(bytes(key) * 3), modes.ECB(), backend=default_backend())
+        self.encryptor = cipher.encryptor()
+        self.decryptor = cipher.decryptor()
+
+    def encrypt(self, data, output):
+        output[:] = self.encryptor.update(buffers.to_bytes(data))
+
+    def decrypt(self, data, output):
+        output[:] = self.decryptor.update(buffers.to_bytes(data))
+
+@register_backend
+class Cryptography_Backend(Backend):
+    name = "cryptography"
+
+    @staticmethod
+    def is_available():
+        return Cipher is not None
+
+    def new_des(self, key):
+        return Cryptography_Des(key)
+
+class Python_Des():
+    def __init__(self, key):
+        self.cipher = des.DES_Cipher(key)
+
+    def encrypt(self, data, output):
+        output[:] = self.cipher.encrypt(data)
+
+    def decrypt(self, data, output):
+        output[:] = self.cipher.decrypt(data)
+
+@register_backend
+class Python_Backend(Backend):
+    name = "python"
+
+    @staticmethod
+    def is_available():
+        return True
+
+    def new_des(self, key):
+        return Python_Des(key)
+
+def get_available_backends():
+    return [name for (name, backend_class) in backends.items() if backend_class.is_available()]
+
+#
+# Time a cartridge sized DESX encryption, key setup included, on each
+# available backend
+#
+def calibrate_backends(iterations=20, repeat=3):
+    key = bytearray(range(8))
+    mask = bytearray(range(72))
+    timings = {}
+
+    for name in get_available_backends():
+        backend = backends[name]()
+        data = bytearray(72)
+
+        def run():
+            for i in range(iterations):
+                cipher = backend.new_des(key)
+                backend.xor(data, mask, data)
+                cipher.encrypt(data, data)
+                backend.xor(data, mask, data)
+
+        timings[name] = min(timeit.repeat(run, number=1, repeat=repeat))
+
+    return timings
+
+def get_backend_cache_path():
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "stratatools", "crypto_backend.json")
+
+#
+# Return the name of the fastest backend, from the cache when it was
+# calibrated on the same platform with the same backends available
+#
+def select_backend(cache_path=None):
+    if cache_path is None:
+        cache_path = get_backend_cache_path()
+
+    available = get_available_backends()
+    fingerprint = "-".join([platform.machine(), platform.python_version()] + available)
+
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached["fingerprint"] == fingerprint and cached["backend"] in available:
+            return cached["backend"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    timings = calibrate_backends()
+    name = min(timings, key=timings.get)
+
+    try:
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        with open(cache_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "backend": name, "timings": timings}, f)
+    except (IOError, OSError):
+        pass
+
+    return name
+
+selected_backend = None
+
+def get_backend(name=None):
+    global selected_backend
+
+    if name is None:
+        name = os.environ.get(BACKEND_ENVIRONMENT_VARIABLE)
+
+    if name:
+        if name not in backends:
+            raise Exception("unknown crypto backend <" + name + ">, expected one of " + ", ".join(backends.keys()))
+        if not backends[name].is_available():
+            raise Exception("crypto backend <" + name + "> is not available")
+        return backends[name]()
+
+    if selected_backend is None:
+        selected_backend = backends[select_backend()]()
+
+    return selected_backend
+
+class Crypto():
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    #
+    # The backend given to the constructor, otherwise the selected one,
+    # selecting (and calibrating) it only when first needed
+    #
+    def get_backend(self):
+        if self.backend is None:
+            self.backend = get_backend()
+        return self.backend
+
     def encrypt(self, key, plaintext):
         pass
 
     def decrypt(self, key, ciphertext):
         pass
 
+#
+# A prepared DESX key: both whitening keys, the DES cipher and the whitening
+# masks already repeated for each buffer length seen
+#
+Desx_Context = collections.namedtuple("Desx_Context", ["input_whitener", "output_whitener", "des", "masks"])
+
+Cache_Info = collections.namedtuple("Cache_Info", ["hits", "misses", "maxsize", "currsize"])
+
 class Desx_Crypto(Crypto):
-    def __init__(self):
+    def __init__(self, cache_size=128, backend=None):
+        Crypto.__init__(self, backend)
+
+        # LRU cache of prepared key contexts, keyed by the 16 bytes key
+        self.contexts = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
         self.clorox = [
                 0xBD,0x56,0xEA,0xF2,0xA2,0xF1,0xAC,0x2A,0xB0,0x93,0xD1,
                 0x9C,0x1B,0x33,0xFD,0xD0,0x30,0x04,0xB6,0xDC,0x7D,0xDF,
@@ -65,33 +300,153 @@ class Desx_Crypto(Crypto):
 
         return (input_whitener, output_whitener)
 
-    def encrypt(self, key, plaintext):
-        (input_whitening_key, output_whitening_key) = self.build_whitening_keys(key)
+    #
+    # Resize the key context cache, 0 disables caching
+    #
+    def set_cache_size(self, cache_size):
+        self.cache_size = cache_size
+        while len(self.contexts) > max(cache_size, 0):
+            self.contexts.popitem(last=False)
+
+    def cache_info(self):
+        return Cache_Info(self.cache_hits, self.cache_misses, self.cache_size, len(self.contexts))
+
+    def cache_clear(self):
+        self.contexts.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def build_context(self, key):
+        (input_whitener, output_whitener) = self.build_whitening_keys(key)
+        cipher = self.get_backend().new_des(key[0:8])
+        return Desx_Context(bytes(input_whitener), bytes(output_whitener), cipher, {})
+
+    #
+    # Get the prepared context of a key, building it on a cache miss
+    #
+    def get_context(self, key):
+        key = buffers.to_bytes(key)
+
+        context = self.contexts.pop(key, None)
+        if context is None:
+            self.cache_misses += 1
+            context = self.build_context(bytearray(key))
+            if self.cache_size <= 0:
+                return context
+            if len(self.contexts) >= self.cache_size:
+                self.contexts.popitem(last=False)
+        else:
+            self.cache_hits += 1
 
-        ciphertext = bytearray(len(plaintext))
+        # Most recently used keys are kept at the end
+        self.contexts[key] = context
+
+        return context
+
+    #
+    # The whole buffer is whitened at once with a repeated mask and goes
+    # through a single ECB call, every step writing into the output buffer
+    #
+    # out is a writable buffer of the same length (a bytearray or a
+    # memoryview), possibly the input itself to work in place. A new
+    # bytearray is returned when it is not given.
+    #
+    def encrypt(self, key, plaintext, out=None):
+        context = self.get_context(key)
 
         if (len(plaintext) % 8):
             raise Exception("plaintext length must be a multiple of 8")
 
-        des = DES.new(str(key[0:8]), DES.MODE_CBC, str(bytearray(8))).encrypt
-        for i in range(len(plaintext)/8):
-            ciphertext[i*8:i*8+8] = strxor(output_whitening_key, des(strxor(input_whitening_key, str(plaintext[i*8:i*8+8]))))
+        (input_mask, output_mask) = self._get_masks(context, len(plaintext) // 8)
+        ciphertext = self._get_output(plaintext, out)
 
-            des = DES.new(str(key[0:8]), DES.MODE_CBC, str(bytearray(8))).encrypt
+        backend = self.get_backend()
+        backend.xor(plaintext, input_mask, ciphertext)
+        context.des.encrypt(ciphertext, ciphertext)
+        backend.xor(ciphertext, output_mask, ciphertext)
 
         return ciphertext
 
-    def decrypt(self, key, ciphertext):
-        (input_whitening_key, output_whitening_key) = self.build_whitening_keys(key)
-
-        plaintext = bytearray(len(ciphertext))
+    def decrypt(self, key, ciphertext, out=None):
+        context = self.get_context(key)
 
         if (len(ciphertext) % 8):
             raise Exception("ciphertext length must be a multiple of 8")
 
-        des = DES.new(str(key[0:8]), DES.MODE_CBC, str(bytearray(8))).decrypt
-        for i in range(len(ciphertext)/8):
-            plaintext[i*8:i*8+8] = bytearray(strxor(input_whitening_key, des(strxor(output_whitening_key, str(ciphertext[i*8:i*8+8])))))
-            des = DES.new(str(key[0:8]), DES.MODE_CBC, str(bytearray(8))).decrypt
+        (input_mask, output_mask) = self._get_masks(context, len(ciphertext) // 8)
+        plaintext = self._get_output(ciphertext, out)
+
+        backend = self.get_backend()
+        backend.xor(ciphertext, output_mask, plaintext)
+        context.des.decrypt(plaintext, plaintext)
+        backend.xor(plaintext, input_mask, plaintext)
 
         return plaintext
+
+    # Whiteners repeated over a number of blocks, kept with the context
+    def _get_masks(self, context, blocks):
+        masks = context.masks.get(blocks)
+        if masks is None:
+            masks = (context.input_whitener * blocks, context.output_whitener * blocks)
+            context.masks[blocks] = masks
+        return masks
+
+    def _get_output(self, data, out):
+        if out is None:
+            return bytearray(len(data))
+        if len(out) != len(data):
+            raise Exception("output length must be " + str(len(data)) + ", got " + str(len(out)))
+        return out
+
+#
+# DESX over a batch of cartridges, each with its own key
+#
+# Keys are given as a (N, 16) array and data as a (N, blocks, 8) array, row n
+# of data being processed with key n. Every row goes through the vectorized
+# DES of stratatools.des at once.
+#
+class Desx_Batch_Crypto(Desx_Crypto):
+    def __init__(self, cache_size=128, backend=None):
+        if numpy is None:
+            raise Exception("numpy is required for batch crypto")
+
+        Desx_Crypto.__init__(self, cache_size, backend)
+        self.clorox_array = numpy.array(self.clorox, dtype=numpy.uint8)
+
+    def build_whitening_keys_batch(self, keys):
+        input_whiteners = keys[:, 8:16]
+        output_whiteners = numpy.zeros((len(keys), 8), dtype=numpy.uint8)
+
+        for i in range(16):
+            clorox_i = output_whiteners[:, 0] ^ output_whiteners[:, 1]
+            output_whiteners[:, 0:7] = output_whiteners[:, 1:8].copy()
+            output_whiteners[:, 7] = self.clorox_array[clorox_i] ^ keys[:, i]
+
+        return (input_whiteners[:, numpy.newaxis, :], output_whiteners[:, numpy.newaxis, :])
+
+    def _prepare_batch(self, keys, data):
+        keys = numpy.asarray(keys, dtype=numpy.uint8).reshape(-1, 16)
+        data = numpy.asarray(data, dtype=numpy.uint8)
+
+        if len(data) != len(keys):
+            raise Exception("expected one key per row, got " + str(len(keys)) + " keys for " + str(len(data)) + " rows")
+        if (data[0:1].size % 8):
+            raise Exception("data length must be a multiple of 8")
+
+        return (keys, data.reshape(len(keys), -1, 8))
+
+    def encrypt_batch(self, keys, plaintexts):
+        (keys, blocks) = self._prepare_batch(keys, plaintexts)
+        (input_whiteners, output_whiteners) = self.build_whitening_keys_batch(keys)
+
+        blocks = des.crypt_batch(des.key_schedule_batch(keys[:, 0:8]), blocks ^ input_whiteners)
+
+        return (blocks ^ output_whiteners).reshape(numpy.shape(plaintexts))
+
+    def decrypt_batch(self, keys, ciphertexts):
+        (keys, blocks) = self._prepare_batch(keys, ciphertexts)
+        (input_whiteners, output_whiteners) = self.build_whitening_keys_batch(keys)
+
+        blocks = des.crypt_batch(des.key_schedule_batch(keys[:, 0:8]), blocks ^ output_whiteners, decrypt=True)
+
+        return (blocks ^ input_whiteners).reshape(numpy.shape(ciphertexts))
@@ -1,23 +1,188 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
-from stratatools.crypto import Desx_Crypto
+from Crypto.Cipher import DES
+from Crypto.Util.strxor import strxor
+from stratatools import crypto
+from stratatools.crypto import Desx_Crypto, Desx_Batch_Crypto
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 DESX_KEY = bytearray(b"\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f")
 
-class TestCrypto(unittest.TestCase):
+# Block by block DESX, the way it was done before the single pass path
+def reference_desx_encrypt(key, plaintext):
+    (input_whitener, output_whitener) = Desx_Crypto().build_whitening_keys(key)
+    ciphertext = bytearray()
+    for i in range(0, len(plaintext), 8):
+        des = DES.new(bytes(key[0:8]), DES.MODE_CBC, bytes(bytearray(8)))
+        ciphertext += strxor(bytes(output_whitener), des.encrypt(strxor(bytes(input_whitener), bytes(plaintext[i:i+8]))))
+    return ciphertext
+
+#
+# Test case mixin keeping the backend calibration cache out of the home
+# directory, for the tests building a crypto without an explicit backend
+#
+class Backend_Cache_Fixture:
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = self.cache_dir
+
+    def tearDown(self):
+        if self.xdg_cache_home is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = self.xdg_cache_home
+        shutil.rmtree(self.cache_dir)
+
+class TestCrypto(Backend_Cache_Fixture, unittest.TestCase):
     def test_desx_encrypt(self):
         expected_ciphertext = bytearray(b"\x38\xdb\x9b\xe0\x9d\x1b\x24\xa0\x7c\x77\x49\x26\xaf\x94\xe8\xd5")
 
         desx = Desx_Crypto()
 
-        ciphertext = desx.encrypt(DESX_KEY, "this is a test..")
+        ciphertext = desx.encrypt(DESX_KEY, b"this is a test..")
 
         assert expected_ciphertext == ciphertext
 
     def test_desx_encrypt_decrypt(self):
-        expected_plaintext = "this is a test.."
+        expected_plaintext = b"this is a test.."
 
         desx = Desx_Crypto()
 
         plaintext = desx.decrypt(DESX_KEY, desx.encrypt(DESX_KEY, expected_plaintext))
 
         assert expected_plaintext == plaintext
+
+    def test_desx_out(self):
+        desx = Desx_Crypto()
+        expected_ciphertext = desx.encrypt(DESX_KEY, b"this is a test..")
+
+        buffer = bytearray(b"xxxxthis is a test..xxxx")
+        view = memoryview(buffer)[4:20]
+        assert desx.encrypt(DESX_KEY, view, out=view) is view
+        assert buffer[4:20] == expected_ciphertext
+        assert buffer[0:4] == b"xxxx" and buffer[20:24] == b"xxxx"
+
+        plaintext = bytearray(16)
+        desx.decrypt(DESX_KEY, view, out=plaintext)
+        assert plaintext == b"this is a test.."
+
+        self.assertRaises(Exception, desx.encrypt, DESX_KEY, b"this is a test..", bytearray(8))
+
+    def test_desx_context_cache(self):
+        desx = Desx_Crypto(cache_size=1)
+
+        ciphertext = desx.encrypt(DESX_KEY, b"this is a test..")
+        desx.decrypt(DESX_KEY, ciphertext)
+
+        info = desx.cache_info()
+        assert info.hits == 1
+        assert info.misses == 1
+        assert info.currsize == 1
+
+        other_key = bytearray(reversed(DESX_KEY))
+        desx.encrypt(other_key, b"this is a test..")
+        assert desx.decrypt(DESX_KEY, ciphertext) == b"this is a test.."
+
+        info = desx.cache_info()
+        assert info.misses == 3
+        assert info.currsize == 1
+
+    def test_desx_cache_disabled(self):
+        desx = Desx_Crypto(cache_size=0)
+
+        desx.encrypt(DESX_KEY, b"this is a test..")
+        desx.encrypt(DESX_KEY, b"this is a test..")
+
+        assert desx.cache_info().misses == 2
+        assert desx.cache_info().currsize == 0
+
+    def test_desx_multiblock_matches_reference(self):
+        plaintext = bytearray(os.urandom(4096))
+
+        desx = Desx_Crypto()
+        ciphertext = desx.encrypt(DESX_KEY, plaintext)
+
+        assert reference_desx_encrypt(DESX_KEY, plaintext) == ciphertext
+        assert plaintext == desx.decrypt(DESX_KEY, ciphertext)
+
+    def test_desx_invalid_length(self):
+        desx = Desx_Crypto()
+
+        self.assertRaises(Exception, desx.encrypt, DESX_KEY, "not a block")
+        self.assertRaises(Exception, desx.decrypt, DESX_KEY, "not a block")
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_desx_batch_matches_desx(self):
+        keys = numpy.frombuffer(os.urandom(32 * 16), dtype=numpy.uint8).reshape(32, 16)
+        plaintexts = numpy.frombuffer(os.urandom(32 * 72), dtype=numpy.uint8).reshape(32, 9, 8)
+
+        desx = Desx_Crypto()
+        batch = Desx_Batch_Crypto()
+        ciphertexts = batch.encrypt_batch(keys, plaintexts)
+
+        assert ciphertexts.shape == plaintexts.shape
+        for i in range(len(keys)):
+            expected = desx.encrypt(bytearray(keys[i].tobytes()), plaintexts[i].tobytes())
+            assert expected == bytearray(ciphertexts[i].tobytes())
+
+        assert (batch.decrypt_batch(keys, ciphertexts) == plaintexts).all()
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_desx_batch_known_ciphertext(self):
+        expected_ciphertext = bytearray(b"\x38\xdb\x9b\xe0\x9d\x1b\x24\xa0\x7c\x77\x49\x26\xaf\x94\xe8\xd5")
+
+        keys = numpy.frombuffer(bytes(DESX_KEY), dtype=numpy.uint8).reshape(1, 16)
+        plaintexts = numpy.frombuffer(b"this is a test..", dtype=numpy.uint8).reshape(1, 16)
+
+        batch = Desx_Batch_Crypto()
+        ciphertexts = batch.encrypt_batch(keys, plaintexts)
+
+        assert expected_ciphertext == bytearray(ciphertexts[0].tobytes())
+        # The batch path does not need a backend
+        assert batch.backend is None
+
+    def test_desx_backends(self):
+        expected_ciphertext = bytearray(b"\x38\xdb\x9b\xe0\x9d\x1b\x24\xa0\x7c\x77\x49\x26\xaf\x94\xe8\xd5")
+
+        for name in crypto.get_available_backends():
+            desx = Desx_Crypto(backend=crypto.get_backend(name))
+
+            ciphertext = desx.encrypt(DESX_KEY, b"this is a test..")
+
+            assert expected_ciphertext == ciphertext, name
+            assert b"this is a test.." == desx.decrypt(DESX_KEY, ciphertext), name
+
+    def test_backend_environment_override(self):
+        os.environ[crypto.BACKEND_ENVIRONMENT_VARIABLE] = "python"
+        try:
+            assert crypto.get_backend().name == "python"
+        finally:
+            del os.environ[crypto.BACKEND_ENVIRONMENT_VARIABLE]
+
+        self.assertRaises(Exception, crypto.get_backend, "rot13")
+
+    def test_select_backend_cached(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache_path = os.path.join(cache_dir, "stratatools", "crypto_backend.json")
+
+            name = crypto.select_backend(cache_path)
+            assert name in crypto.get_available_backends()
+
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            cached["backend"] = "python"
+            with open(cache_path, "w") as f:
+                json.dump(cached, f)
+
+            assert crypto.select_backend(cache_path) == "python"
+        finally:
+            shutil.rmtree(cache_dir)
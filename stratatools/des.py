@@ -0,0 +1,255 @@
+#
+# See the LICENSE file
+#
+
+#
+# DES tables, a pure Python DES and a vectorized DES used to process many
+# blocks, each with its own key, at once.
+#
+# Bits are numbered from 1 (most significant) to 64 as in FIPS 46-3.
+#
+
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Initial permutation
+IP = [
+    58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4,
+    62, 54, 46, 38, 30, 22, 14, 6, 64, 56, 48, 40, 32, 24, 16, 8,
+    57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+    61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7]
+
+# Final permutation (inverse of IP)
+FP = [
+    40, 8, 48, 16, 56, 24, 64, 32, 39, 7, 47, 15, 55, 23, 63, 31,
+    38, 6, 46, 14, 54, 22, 62, 30, 37, 5, 45, 13, 53, 21, 61, 29,
+    36, 4, 44, 12, 52, 20, 60, 28, 35, 3, 43, 11, 51, 19, 59, 27,
+    34, 2, 42, 10, 50, 18, 58, 26, 33, 1, 41, 9, 49, 17, 57, 25]
+
+# Permuted choice 1, drops the parity bits
+PC1 = [
+    57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18,
+    10, 2, 59, 51, 43, 35, 27, 19, 11, 3, 60, 52, 44, 36,
+    63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22,
+    14, 6, 61, 53, 45, 37, 29, 21, 13, 5, 28, 20, 12, 4]
+
+# Permuted choice 2, 56 bits to a 48 bits subkey
+PC2 = [
+    14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10,
+    23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+    41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48,
+    44, 49, 39, 56, 34, 53, 46, 42, 50, 36, 29, 32]
+
+# Left rotations of the key halves for each round
+SHIFTS = [1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1]
+
+# Permutation of the S-boxes output
+P = [
+    16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10,
+    2, 8, 24, 14, 32, 27, 3, 9, 19, 13, 30, 6, 22, 11, 4, 25]
+
+SBOXES = [
+    [14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7,
+     0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11, 9, 5, 3, 8,
+     4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0,
+     15, 12, 8, 2, 4, 9, 1, 7, 5, 11, 3, 14, 10, 0, 6, 13],
+    [15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10,
+     3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10, 6, 9, 11, 5,
+     0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15,
+     13, 8, 10, 1, 3, 15, 4, 2, 11, 6, 7, 12, 0, 5, 14, 9],
+    [10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8,
+     13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14, 12, 11, 15, 1,
+     13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7,
+     1, 10, 13, 0, 6, 9, 8, 7, 4, 15, 14, 3, 11, 5, 2, 12],
+    [7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15,
+     13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12, 1, 10, 14, 9,
+     10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4,
+     3, 15, 0, 6, 10, 1, 13, 8, 9, 4, 5, 11, 12, 7, 2, 14],
+    [2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9,
+     14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10, 3, 9, 8, 6,
+     4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14,
+     11, 8, 12, 7, 1, 14, 2, 13, 6, 15, 0, 9, 10, 4, 5, 3],
+    [12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11,
+     10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14, 0, 11, 3, 8,
+     9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6,
+     4, 3, 2, 12, 9, 5, 15, 10, 11, 14, 1, 7, 6, 0, 8, 13],
+    [4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1,
+     13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12, 2, 15, 8, 6,
+     1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2,
+     6, 11, 13, 8, 1, 4, 10, 7, 9, 5, 0, 15, 14, 2, 3, 12],
+    [13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7,
+     1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11, 0, 14, 9, 2,
+     7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8,
+     2, 1, 14, 7, 4, 10, 8, 13, 15, 12, 9, 0, 3, 5, 6, 11]]
+
+def permute(value, table, width):
+    result = 0
+    for bit in table:
+        result = (result << 1) | ((value >> (width - bit)) & 1)
+    return result
+
+#
+# Combined S-box and P permutation tables: SP[i][v] is the 32 bits output of
+# the round function contributed by the 6 bits input v of S-box i
+#
+def build_sp_tables():
+    sp = []
+    for i in range(8):
+        table = []
+        for v in range(64):
+            row = ((v >> 4) & 0x2) | (v & 0x1)
+            column = (v >> 1) & 0xf
+            table.append(permute(SBOXES[i][row * 16 + column] << (28 - 4 * i), P, 32))
+        sp.append(table)
+    return sp
+
+SP = build_sp_tables()
+
+#
+# Split the 48 bits subkeys of a 64 bits key into the eight 6 bits chunks
+# fed to each S-box
+#
+def key_schedule(key):
+    key = permute(key, PC1, 64)
+    c = key >> 28
+    d = key & 0xfffffff
+
+    subkeys = []
+    for shift in SHIFTS:
+        c = ((c << shift) | (c >> (28 - shift))) & 0xfffffff
+        d = ((d << shift) | (d >> (28 - shift))) & 0xfffffff
+        subkey = permute((c << 28) | d, PC2, 56)
+        subkeys.append([(subkey >> (42 - 6 * i)) & 0x3f for i in range(8)])
+
+    return subkeys
+
+#
+# Vectorized DES
+#
+# Every block of row n is processed with the key of row n. The whole batch
+# goes through each round at once with table lookups.
+#
+
+#
+# Swap the bits of a selected by mask with the bits of b, n positions lower
+#
+def _swap_bits(a, b, n, mask):
+    t = ((a >> n) ^ b) & mask
+    return (a ^ (t << n), b ^ t)
+
+#
+# IP and FP as a sequence of bit swaps between the two 32 bits halves
+#
+def _initial_permutation(left, right):
+    (left, right) = _swap_bits(left, right, 4, 0x0f0f0f0f)
+    (left, right) = _swap_bits(left, right, 16, 0x0000ffff)
+    (right, left) = _swap_bits(right, left, 2, 0x33333333)
+    (right, left) = _swap_bits(right, left, 8, 0x00ff00ff)
+    (left, right) = _swap_bits(left, right, 1, 0x55555555)
+    return (left, right)
+
+def _final_permutation(left, right):
+    (left, right) = _swap_bits(left, right, 1, 0x55555555)
+    (right, left) = _swap_bits(right, left, 8, 0x00ff00ff)
+    (right, left) = _swap_bits(right, left, 2, 0x33333333)
+    (left, right) = _swap_bits(left, right, 16, 0x0000ffff)
+    (left, right) = _swap_bits(left, right, 4, 0x0f0f0f0f)
+    return (left, right)
+
+def _rotate_left(halves, shift):
+    return numpy.concatenate((halves[:, shift:], halves[:, :shift]), axis=1)
+
+#
+# keys: (N, 8) uint8 array, returns a (N, 16, 8) uint8 array of subkeys chunks
+#
+def key_schedule_batch(keys):
+    bits = numpy.unpackbits(numpy.ascontiguousarray(keys, dtype=numpy.uint8), axis=1)
+    bits = bits[:, numpy.array(PC1) - 1]
+    c = bits[:, :28]
+    d = bits[:, 28:]
+
+    weights = numpy.array([32, 16, 8, 4, 2, 1], dtype=numpy.uint8)
+    pc2 = numpy.array(PC2) - 1
+    subkeys = numpy.empty((len(keys), 16, 8), dtype=numpy.uint8)
+    for (i, shift) in enumerate(SHIFTS):
+        c = _rotate_left(c, shift)
+        d = _rotate_left(d, shift)
+        subkey = numpy.concatenate((c, d), axis=1)[:, pc2]
+        subkeys[:, i] = (subkey.reshape(-1, 8, 6) * weights).sum(axis=2)
+
+    return subkeys
+
+#
+# subkeys: (N, 16, 8) array from key_schedule_batch
+# blocks: (N, B, 8) uint8 array
+#
+def crypt_batch(subkeys, blocks, decrypt=False):
+    sp = [numpy.array(table, dtype=numpy.uint32) for table in SP]
+
+    halves = numpy.ascontiguousarray(blocks, dtype=numpy.uint8).view(">u4").astype(numpy.uint32)
+    (left, right) = _initial_permutation(halves[..., 0], halves[..., 1])
+
+    rounds = range(16)
+    if decrypt:
+        rounds = reversed(rounds)
+
+    for r in rounds:
+        # Subkey chunks, broadcasted over every block of a row
+        k = subkeys[:, r, :, numpy.newaxis].astype(numpy.uint32)
+
+        # Expansion, x starts with bit 32 of the right half
+        x = (right >> 1) | (right << 31)
+        f = sp[7][(((x & 0xf) << 2) | (x >> 30)) ^ k[:, 7]]
+        for i in range(7):
+            f |= sp[i][((x >> (26 - 4 * i)) & 0x3f) ^ k[:, i]]
+
+        (left, right) = (right, left ^ f)
+
+    # The halves are swapped after the last round
+    halves = numpy.empty(numpy.shape(blocks)[:-1] + (2,), dtype=">u4")
+    (halves[..., 0], halves[..., 1]) = _final_permutation(right, left)
+
+    return halves.view(numpy.uint8)
+
+#
+# Pure Python DES
+#
+
+def crypt(subkeys, data):
+    sp0, sp1, sp2, sp3, sp4, sp5, sp6, sp7 = SP
+
+    blocks = len(data) // 8
+    halves = list(struct.unpack_from(">%dI" % (blocks * 2), data))
+    for i in range(0, blocks * 2, 2):
+        (left, right) = _initial_permutation(halves[i], halves[i+1])
+
+        for k in subkeys:
+            x = ((right >> 1) | (right << 31)) & 0xffffffff
+            f = (sp0[((x >> 26) & 0x3f) ^ k[0]] |
+                 sp1[((x >> 22) & 0x3f) ^ k[1]] |
+                 sp2[((x >> 18) & 0x3f) ^ k[2]] |
+                 sp3[((x >> 14) & 0x3f) ^ k[3]] |
+                 sp4[((x >> 10) & 0x3f) ^ k[4]] |
+                 sp5[((x >> 6) & 0x3f) ^ k[5]] |
+                 sp6[((x >> 2) & 0x3f) ^ k[6]] |
+                 sp7[(((x & 0xf) << 2) | (x >> 30)) ^ k[7]])
+            (left, right) = (right, left ^ f)
+
+        (halves[i], halves[i+1]) = _final_permutation(right, left)
+
+    return struct.pack(">%dI" % (blocks * 2), *halves)
+
+class DES_Cipher():
+    def __init__(self, key):
+        self.subkeys = key_schedule(struct.unpack(">Q", bytes(key))[0])
+        self.subkeys_reversed = list(reversed(self.subkeys))
+
+    def encrypt(self, data):
+        return crypt(self.subkeys, data)
+
+    def decrypt(self, data):
+        return crypt(self.subkeys_reversed, data)
@@ -3,6 +3,9 @@
 #
 import re
 import binascii
+import collections
+
+from stratatools.buffers import diff_ranges
 
 class Formatter:
     def __init__(self):
@@ -14,33 +17,266 @@ class Formatter:
     def to_destination(self, data):
         raise Exception("this class cannot be used")
 
+#
+# A line of a diagnostic port dump
+#
+# line: line number in the log, starting at 1
+# position: position of the line in the log, in characters
+# offset: EEPROM offset of the first byte of the line
+# data: bytes of the line
+#
+Diag_Line = collections.namedtuple("Diag_Line", ["line", "position", "offset", "data"])
+
+#
+# A dump found in a log, line and position being the ones of its first line
+# and offset its first EEPROM offset
+#
+Diag_Dump = collections.namedtuple("Diag_Dump", ["line", "position", "offset", "image"])
+
+#
+# An 'ew' command writing data at an EEPROM offset
+#
+Ew_Command = collections.namedtuple("Ew_Command", ["offset", "data"])
+
 class DiagnosticPort_Formatter(Formatter):
-    def __init__(self):
+    def __init__(self, chunk_size=65536):
         self.rx = re.compile('^[0-9]{6}: ((?:[0-9a-f-A-F]{2} ?)+).*?$',re.MULTILINE)
+        self.line_rx = re.compile('^([0-9]{6}): ((?:[0-9a-fA-F]{2} ?)+)')
+        self.chunk_size = chunk_size
 
 #Reads a series of newline delimited lines of the format:
 #000096: 00 00 00 00 00 00 00 00 53 54 52 41 54 41 53 59   ........STRATASY
 
     def from_source(self, data):
-        formatted = b''
+        formatted = []
         idx = 1
         for match in self.rx.finditer(data):
             try:
                 #Get a line of data with whitespace removed
                 line = match.group(1).replace(' ', '')
-                formatted += binascii.unhexlify(line)
+                formatted.append(binascii.unhexlify(line))
                 idx=idx+1
             except IndexError:
                 print("Error on line %s when reading diag port formatted data" % (idx,))
                 raise
 
-        return formatted
+        return b''.join(formatted)
+
+    #
+    # Read the lines of a file-like object, chunk_size characters at a time,
+    # yielding (line number, position, line)
+    #
+    def iter_lines(self, f):
+        remainder = ""
+        line_number = 0
+        position = 0
+
+        while True:
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                break
+            if not isinstance(chunk, str):
+                chunk = chunk.decode("latin-1")
+
+            lines = (remainder + chunk).split("\n")
+            remainder = lines.pop()
+            for line in lines:
+                line_number += 1
+                yield (line_number, position, line)
+                position += len(line) + 1
+
+        if remainder:
+            yield (line_number + 1, position, remainder)
+
+    #
+    # Parse the dump lines of a file-like object, yielding a Diag_Line for
+    # each of them, other lines are skipped
+    #
+    # Offsets are the 6 digits decimal offsets printed by the 'er' command.
+    #
+    def iter_source(self, f):
+        for (line_number, position, line) in self.iter_lines(f):
+            match = self.line_rx.match(line)
+            if match is None:
+                continue
+
+            try:
+                data = binascii.unhexlify(match.group(2).replace(' ', ''))
+            except (TypeError, binascii.Error):
+                raise Exception("line " + str(line_number) + ": invalid hexadecimal data")
+
+            yield Diag_Line(line_number, position, int(match.group(1), 10), data)
+
+    #
+    # Read a dump from a file-like object, the offsets must be contiguous
+    #
+    def from_file(self, f):
+        formatted = []
+        expected = None
+
+        for line in self.iter_source(f):
+            if expected is not None and line.offset != expected:
+                raise Exception("line " + str(line.line) + ": expected offset %06d but got %06d" % (expected, line.offset))
+            formatted.append(line.data)
+            expected = line.offset + len(line.data)
+
+        return b''.join(formatted)
+
+    #
+    # Read size bytes images from a file-like object, yielding each one as
+    # soon as it is complete
+    #
+    # Each image starts at offset 000000 and its offsets must be contiguous.
+    # The image is filled into a preallocated bytearray and a copy is yielded.
+    #
+    def iter_images(self, f, size=512):
+        image = bytearray(size)
+        position = 0
+        last_line = 0
+
+        for line in self.iter_source(f):
+            last_line = line.line
+            if line.offset != position:
+                raise Exception("line " + str(line.line) + ": expected offset %06d but got %06d" % (position, line.offset))
+
+            end = position + len(line.data)
+            if end > size:
+                raise Exception("line " + str(line.line) + ": data past the image size of " + str(size) + " bytes")
+
+            image[position:end] = line.data
+            position = end
+
+            if position == size:
+                yield bytearray(image)
+                position = 0
+
+        if position != 0:
+            raise Exception("line " + str(last_line) + ": truncated image, got " + str(position) + " of " + str(size) + " bytes")
+
+    #
+    # Split a log holding several dumps, one after another, yielding a
+    # Diag_Dump per dump as soon as the next one starts
+    #
+    # A dump ends when the offsets restart at 000000 or jump, so the images
+    # can go straight to Manager.decode_many.
+    #
+    def iter_dumps(self, f):
+        first = None
+        parts = []
+        expected = None
+
+        for line in self.iter_source(f):
+            if first is not None and line.offset != expected:
+                yield Diag_Dump(first.line, first.position, first.offset, bytearray(b''.join(parts)))
+                first = None
+                parts = []
+
+            if first is None:
+                first = line
+            parts.append(line.data)
+            expected = line.offset + len(line.data)
+
+        if first is not None:
+            yield Diag_Dump(first.line, first.position, first.offset, bytearray(b''.join(parts)))
 
 #Produces a double-quoted, space separated string suitable for providing to the uPrint's 'ew' diagnostic command
     def to_destination(self, data):
-        formatted = "\""
+        return "\"" + _spaced_hex(data) + "\""
+
+    #
+    # The 'ew' command line of a write, the offset is decimal like in the
+    # 'er' dumps
+    #
+    def format_command(self, command):
+        return "ew " + str(command.offset) + " " + self.to_destination(command.data)
+
+    #
+    # Plan the 'ew' commands turning the old image into the new one, writing
+    # only the bytes that changed
+    #
+    # Two changed ranges are written by a single command when sending the
+    # unchanged bytes between them takes fewer characters than another
+    # command. Without max_length each gap is decided on its own, which
+    # gives the shortest total. max_length limits the bytes written by one
+    # command: ranges are only merged while they fit in one command, longer
+    # changed ranges are split, so every command writes changed bytes. The
+    # total is then not always the shortest, a merge refused at one gap is
+    # not weighed against the splits it would have saved.
+    #
+    def plan_commands(self, old, new, max_length=None):
+        old = bytearray(old)
+        new = bytearray(new)
+
+        ranges = []
+        for (start, end) in diff_ranges(old, new):
+            if ranges:
+                (previous_start, previous_end) = ranges[-1]
+                # Each byte of the gap takes 3 characters, "xx ", plus the
+                # space joining both ranges
+                merged_cost = 3 * (start - previous_end) + 1
+                command_cost = len(self.format_command(Ew_Command(start, b""))) + 1
+                fits = max_length is None or end - previous_start <= max_length
+                if merged_cost <= command_cost and fits:
+                    ranges[-1] = (previous_start, end)
+                    continue
+            ranges.append((start, end))
+
+        commands = []
+        for (start, end) in ranges:
+            step = max_length or (end - start)
+            for offset in range(start, end, step):
+                commands.append(Ew_Command(offset, bytes(new[offset:min(offset + step, end)])))
+
+        return commands
+
+    def format_commands(self, commands):
+        return "".join(self.format_command(command) + "\n" for command in commands)
+
+#
+# Hexadecimal of data with a space between each byte, built at once
+#
+def _spaced_hex(data):
+    hexa = binascii.hexlify(bytes(bytearray(data)))
+    if not hexa:
+        return ""
+
+    formatted = bytearray(b" " * (len(hexa) // 2 * 3 - 1))
+    formatted[0::3] = hexa[0::2]
+    formatted[1::3] = hexa[1::2]
+    return str(formatted.decode("ascii"))
+
+#
+# ASCII format of eeprom_encode -a: comment lines starting with '#' then the
+# image in hexadecimal, 32 characters per line
+#
+class Ascii_Formatter(Formatter):
+    def __init__(self, line_length=32):
+        self.line_length = line_length
+
+    def from_source(self, data):
+        if not isinstance(data, str):
+            data = data.decode("latin-1")
+        hexa = "".join(line.strip() for line in data.splitlines() if not line.startswith("#"))
+        return binascii.unhexlify(hexa)
+
+    #
+    # "key: value" comment lines as a dict, e.g. "eeprom uid"
+    #
+    def read_comments(self, data):
+        if not isinstance(data, str):
+            data = data.decode("latin-1")
+
+        comments = collections.OrderedDict()
+        for line in data.splitlines():
+            if line.startswith("#") and ": " in line:
+                (key, value) = line[1:].split(": ", 1)
+                comments[key.strip()] = value.strip()
+        return comments
+
+    def to_destination(self, data, comments=()):
+        lines = ["#" + (" " + comment if comment else "") for comment in comments]
 
-        for b in data:
-            formatted += binascii.hexlify(chr(b)) + " "
+        hexa = binascii.hexlify(bytes(bytearray(data))).decode("ascii")
+        lines.extend(hexa[i:i + self.line_length] for i in range(0, len(hexa), self.line_length))
 
-        return formatted[0:-1] + "\""
+        return str("\n".join(lines) + "\n")
@@ -0,0 +1,125 @@
+import io
+import os
+import unittest
+from stratatools.formatter import Ascii_Formatter, DiagnosticPort_Formatter, Ew_Command, _spaced_hex
+
+def make_dump(data, start=0):
+    lines = []
+    for i in range(0, len(data), 16):
+        chunk = bytearray(data[i:i+16])
+        lines.append("%06d: %s   %s" % (start + i, " ".join("%02x" % b for b in chunk), "".join(chr(b) if 32 <= b < 127 else "." for b in chunk)))
+    return "\n".join(lines) + "\n"
+
+class TestDiagnosticPortFormatter(unittest.TestCase):
+    def test_from_source(self):
+        data = bytearray(os.urandom(128))
+
+        assert DiagnosticPort_Formatter().from_source(make_dump(data)) == data
+
+    def test_to_destination(self):
+        formatter = DiagnosticPort_Formatter()
+
+        assert formatter.to_destination(bytearray(b"\x00\xab\x10")) == '"00 ab 10"'
+        assert formatter.to_destination(bytearray()) == '""'
+
+    def test_from_file(self):
+        data = bytearray(os.urandom(512))
+        log = "er 0 512\n" + make_dump(data) + ">\n"
+
+        # Small chunks so lines are split across reads
+        formatter = DiagnosticPort_Formatter(chunk_size=7)
+        assert formatter.from_file(io.BytesIO(log.encode("latin-1"))) == data
+
+    def test_from_file_gap(self):
+        log = make_dump(bytearray(32)) + make_dump(bytearray(16), start=48)
+
+        try:
+            DiagnosticPort_Formatter().from_file(io.BytesIO(log.encode("latin-1")))
+            assert False
+        except Exception as e:
+            assert "line 3" in str(e)
+
+    def test_iter_images(self):
+        images = [bytearray(os.urandom(64)) for i in range(3)]
+        log = "".join(make_dump(image) + "> er\n" for image in images)
+
+        formatter = DiagnosticPort_Formatter(chunk_size=100)
+        assert list(formatter.iter_images(io.BytesIO(log.encode("latin-1")), size=64)) == images
+
+        truncated = make_dump(images[0]) + make_dump(images[1][0:32])
+        self.assertRaises(Exception, list, formatter.iter_images(io.BytesIO(truncated.encode("latin-1")), size=64))
+
+    def test_iter_dumps(self):
+        images = [bytearray(os.urandom(0x71)), bytearray(os.urandom(64)), bytearray(os.urandom(32))]
+        log = "> er 0 113\n" + make_dump(images[0]) + "> er 0 64\n" + make_dump(images[1]) + make_dump(images[2], start=256)
+
+        formatter = DiagnosticPort_Formatter(chunk_size=50)
+        dumps = list(formatter.iter_dumps(io.BytesIO(log.encode("latin-1"))))
+
+        assert [dump.image for dump in dumps] == images
+        assert [dump.offset for dump in dumps] == [0, 0, 256]
+        assert [dump.line for dump in dumps] == [2, 11, 15]
+        for dump in dumps:
+            assert log[dump.position:].startswith("%06d: " % dump.offset)
+
+    def test_plan_commands(self):
+        formatter = DiagnosticPort_Formatter()
+        old = bytearray(os.urandom(0x71))
+        new = bytearray(old)
+
+        assert formatter.plan_commands(old, new) == []
+
+        # Close ranges are merged, far ones are not
+        new[0x10] ^= 0xff
+        new[0x12] ^= 0xff
+        new[0x60] ^= 0xff
+        new[0x61] ^= 0xff
+        commands = formatter.plan_commands(old, new)
+
+        assert commands == [Ew_Command(0x10, bytes(new[0x10:0x13])), Ew_Command(0x60, bytes(new[0x60:0x62]))]
+        assert formatter.format_commands(commands).splitlines()[1] == "ew 96 \"" + _spaced_hex(new[0x60:0x62]) + "\""
+
+        for max_length in [1, 2, 3, 4]:
+            patched = bytearray(old)
+            for command in formatter.plan_commands(old, new, max_length=max_length):
+                assert len(command.data) <= max_length
+                end = command.offset + len(command.data)
+                assert old[command.offset:end] != new[command.offset:end]
+                patched[command.offset:end] = command.data
+            assert patched == new
+
+        # A split never lands on unchanged bytes
+        zeros = bytearray(8)
+        changed = bytearray(zeros)
+        changed[0] = changed[2] = 1
+        assert formatter.plan_commands(zeros, changed, max_length=1) == [Ew_Command(0, b"\x01"), Ew_Command(2, b"\x01")]
+        assert formatter.plan_commands(zeros, changed, max_length=3) == [Ew_Command(0, b"\x01\x00\x01")]
+
+    def test_plan_commands_shortest(self):
+        formatter = DiagnosticPort_Formatter()
+        old = bytearray(64)
+
+        for gap in range(1, 12):
+            new = bytearray(old)
+            new[0x20] = 1
+            new[0x20 + gap + 1] = 1
+
+            merged = formatter.format_commands([Ew_Command(0x20, bytes(new[0x20:0x20 + gap + 2]))])
+            split = formatter.format_commands([Ew_Command(0x20, b"\x01"), Ew_Command(0x20 + gap + 1, b"\x01")])
+            planned = formatter.format_commands(formatter.plan_commands(old, new))
+
+            assert len(planned) == min(len(merged), len(split))
+
+class TestAsciiFormatter(unittest.TestCase):
+    def test_round_trip(self):
+        data = bytearray(os.urandom(0x71))
+        formatter = Ascii_Formatter()
+
+        ascii = formatter.to_destination(data, ["serial_number: 1234.0", "eeprom uid: 2362474d0100006b", ""])
+        lines = ascii.splitlines()
+
+        assert lines[0] == "# serial_number: 1234.0"
+        assert lines[2] == "#"
+        assert len(lines[3]) == 32
+        assert formatter.from_source(ascii) == data
+        assert formatter.read_comments(ascii)["eeprom uid"] == "2362474d0100006b"
@@ -34,7 +34,7 @@ import re
 import sys
 
 def bin2hex(binary):
-    return "".join(["0x%02X " % ord(b) for b in binary])
+    return "".join(["0x%02X " % b for b in bytearray(binary)])
 
 def ds2433_write_scratchpad(ta1, ta2, payload):
     return "0x0F " + ta1 + " " + ta2 + " " + payload
@@ -122,10 +122,12 @@ def main():
         print("usage: bp_write.py <serial port> <eeprom bin>")
         sys.exit(1)
 
-    f = open(sys.argv[2], "r")
-    data = f.read()
-    data += "\x00" * (512-len(data))
+    # Zero padded EEPROM image, written 32 bytes at a time from views
+    data = bytearray(512)
+    f = open(sys.argv[2], "rb")
+    f.readinto(data)
     f.close()
+    view = memoryview(data)
 
     bp = BusPirate(port=sys.argv[1], timeout=0.2)
     bp.initialize()
@@ -142,7 +144,7 @@ def main():
     print("Begin...")
     for i in range(512/32):
         offset = i * 32
-        payload = bin2hex(data[i*32:i*32+32])
+        payload = bin2hex(view[i*32:i*32+32])
 
         # Write scratchpad
         bp.onewire_write(match_rom_packet)
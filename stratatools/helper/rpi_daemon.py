@@ -8,7 +8,7 @@ import time
 import traceback
 
 from stratatools import *
-from stratatools import machine,cartridge,manager,crypto,checksum,cartridge_pb2
+from stratatools import buffers,machine,cartridge,manager,crypto,checksum,cartridge_pb2
 from google.protobuf.text_format import MessageToString, Merge
 
 cartridge_manager = None
@@ -21,25 +21,50 @@ def read_bytes(path):
         data = bytearray(f.read())
     return data
 
-def write_bytes(path, data):
-    with open(path, "w", buffering=0) as f:
-        f.write(data)
+# Read a file into a preallocated buffer, clearing what the file does not
+# cover
+def read_into(path, buffer):
+    with open(path, "rb") as f:
+        count = f.readinto(buffer)
+    if count < len(buffer):
+        buffer[count:] = bytearray(len(buffer) - count)
+    return count
+
+# Only write the (start, end) ranges of data that changed
+def write_ranges(path, data, ranges):
+    with open(path, "r+b", buffering=0) as f:
+        for (start, end) in ranges:
+            f.seek(start)
+            f.write(data[start:end])
 
 def on_new_cartridge(device):
     eeprom_path = "/sys/" + device.device_path + "/eeprom"
     eeprom_uid = read_bytes("/sys/" + device.device_path + "/id")
 
     print("New device detected <" + binascii.hexlify(eeprom_uid) + ">.")
+
+    # EEPROM buffers come from the manager pool, the daemon runs for a long
+    # time and handles one cartridge after another
+    eeprom = cartridge_manager.pool.acquire()
     try:
-        c = cartridge_template
+        read_into(eeprom_path, eeprom)
 
-        if c is None:
-            c = cartridge_manager.decode(machine_number, eeprom_uid, read_bytes(eeprom_path))
+        if cartridge_template is None:
+            # Refill in place, only the refilled fields are re-encrypted
+            initial_material_quantity = cartridge_manager.read_field(machine_number, eeprom_uid, eeprom, "initial_material_quantity")
             print("Device is a valid cartridge.")
 
-        c = cartridge.refill(c)
-
-        write_bytes(eeprom_path, cartridge_manager.encode(machine_number, eeprom_uid, c))
+            changes = cartridge_manager.patch(machine_number, eeprom_uid, eeprom, cartridge.refill_fields(initial_material_quantity))
+            write_ranges(eeprom_path, eeprom, changes)
+        else:
+            c = cartridge.refill(cartridge_template)
+            refilled = cartridge_manager.encode_into(machine_number, eeprom_uid, c)
+            try:
+                size = cartridge_manager.layout.size
+                changes = buffers.diff_ranges(memoryview(eeprom)[0:size], memoryview(refilled)[0:size])
+                write_ranges(eeprom_path, refilled, changes)
+            finally:
+                cartridge_manager.release(refilled)
 
         print("Refill complete!")
         print("You can safely disconnect the cartridge.")
@@ -47,15 +72,17 @@ def on_new_cartridge(device):
         print("Error! verify machine type?")
         print("Details:")
         traceback.print_exc()
+    finally:
+        cartridge_manager.release(eeprom)
 
 def read_cartridge_template(path):
     catridge = None
 
     with open(path, "r") as f:
-        cartridge = cartridge_pb2.Cartridge()
-        Merge(f.read(), cartridge)
+        template = cartridge_pb2.Cartridge()
+        Merge(f.read(), template)
 
-    return cartridge
+    return cartridge.Cartridge_Record.from_proto(template)
 
 def main():
     global cartridge_manager
@@ -68,7 +95,7 @@ def main():
     args = parser.parse_args()
 
     cartridge_manager = manager.Manager(crypto.Desx_Crypto(), checksum.Crc16_Checksum())
-    machine_number = machine.get_number_from_type(args.machine_type)
+    machine_number = machine.get_machine(args.machine_type).number
     cartridge_template = None
 
     if args.template:
@@ -0,0 +1,127 @@
+#
+# See the LICENSE file
+#
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#
+# Derivation of the 16 bytes key used to encrypt/decrypt a cartridge
+#
+# Each key byte is the complement of one byte of the machine number, of the
+# EEPROM uid or of the cartridge key fragment. The machine number is fixed
+# for a whole run and the uid for a device, so their bytes are computed once
+# into a key template. Only the key fragment bytes are then filled in for
+# each cartridge.
+#
+
+MACHINE = 0
+UID = 1
+FRAGMENT = 2
+
+# Source of each key byte, (source, index)
+KEY_BYTES = [
+    (FRAGMENT, 0), (FRAGMENT, 2), (UID, 2), (FRAGMENT, 6),
+    (MACHINE, 0), (MACHINE, 2), (UID, 6), (MACHINE, 6),
+    (MACHINE, 7), (UID, 1), (MACHINE, 3), (MACHINE, 1),
+    (FRAGMENT, 7), (UID, 5), (FRAGMENT, 3), (FRAGMENT, 1)]
+
+# Index of each key byte in machine number + uid + key fragment
+GATHER = [source * 8 + index for (source, index) in KEY_BYTES]
+
+FRAGMENT_BYTES = [(i, index) for (i, (source, index)) in enumerate(KEY_BYTES) if source == FRAGMENT]
+
+INVERT = bytearray(~i & 0xff for i in range(256))
+
+def _key_part(source, data):
+    data = bytearray(data)
+    key = bytearray(16)
+    for (i, (key_source, index)) in enumerate(KEY_BYTES):
+        if key_source == source:
+            key[i] = INVERT[data[index]]
+    return key
+
+#
+# Key bytes coming from the machine number, the other bytes are 0
+#
+def machine_part(machine_number):
+    return _key_part(MACHINE, machine_number)
+
+#
+# Key bytes coming from the EEPROM uid, the other bytes are 0
+#
+def uid_part(eeprom_uid):
+    return _key_part(UID, eeprom_uid)
+
+def build_template(machine_key_part, uid_key_part):
+    return bytearray(a | b for (a, b) in zip(machine_key_part, uid_key_part))
+
+#
+# Fill in the key fragment bytes of a template
+#
+def build_key_from_template(template, cartridge_key):
+    cartridge_key = bytearray(cartridge_key)
+    key = bytearray(template)
+    for (i, index) in FRAGMENT_BYTES:
+        key[i] = INVERT[cartridge_key[index]]
+    return key
+
+#
+# machine_parts maps machine numbers to their precomputed key part, e.g. the
+# ones of the machine registry, other machines are computed when first seen
+#
+class Key_Builder:
+    def __init__(self, cache_size=1024, machine_parts=None):
+        self.cache_size = cache_size
+        self.machine_parts = dict(machine_parts or {})
+        self.templates = {}
+
+    def get_machine_part(self, machine_number):
+        machine_number = bytes(machine_number)
+        part = self.machine_parts.get(machine_number)
+        if part is None:
+            part = machine_part(machine_number)
+            self.machine_parts[machine_number] = part
+        return part
+
+    #
+    # Template of the key for a machine and a device, cached
+    #
+    def get_template(self, machine_number, eeprom_uid):
+        cache_key = (bytes(machine_number), bytes(eeprom_uid))
+        template = self.templates.get(cache_key)
+        if template is None:
+            if len(self.templates) >= self.cache_size:
+                self.templates.clear()
+            template = build_template(self.get_machine_part(machine_number), uid_part(eeprom_uid))
+            self.templates[cache_key] = template
+        return template
+
+    def build_key(self, cartridge_key, machine_number, eeprom_uid):
+        return build_key_from_template(self.get_template(machine_number, eeprom_uid), cartridge_key)
+
+#
+# Build the keys of a batch of cartridges with a single gather
+#
+# cartridge_keys is a (N, 8) array of key fragments, eeprom_uids a (N, 8)
+# array or a single uid shared by the batch. Returns a (N, 16) uint8 array.
+#
+def build_keys(cartridge_keys, machine_number, eeprom_uids):
+    if numpy is None:
+        raise Exception("numpy is required to build keys in batch")
+
+    cartridge_keys = _as_rows(cartridge_keys)
+    count = len(cartridge_keys)
+
+    eeprom_uids = numpy.broadcast_to(_as_rows(eeprom_uids), (count, 8))
+    machine = numpy.broadcast_to(_as_rows(machine_number), (count, 8))
+
+    sources = numpy.concatenate((machine, eeprom_uids, cartridge_keys), axis=1)
+    return ~sources[:, GATHER]
+
+def _as_rows(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = bytearray(data)
+    return numpy.asarray(data, dtype=numpy.uint8).reshape(-1, 8)
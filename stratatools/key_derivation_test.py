@@ -0,0 +1,53 @@
+import os
+import unittest
+from stratatools import key_derivation
+from stratatools.key_derivation import Key_Builder
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MACHINE_NUMBER = bytearray(b"\x2c\x30\x47\x8b\xb7\xde\x81\xe8")
+EEPROM_UID = bytearray(b"\x23\x62\x47\x4d\x01\x00\x00\x6b")
+
+# Byte by byte derivation, the way it was done in the manager
+def reference_build_key(cartridge_key, machine_number, eeprom_uid):
+    cartridge_key = bytearray(cartridge_key)
+    m = bytearray(machine_number)
+    u = bytearray(eeprom_uid)
+    c = cartridge_key
+    return bytearray(~b & 0xff for b in [
+        c[0], c[2], u[2], c[6], m[0], m[2], u[6], m[6],
+        m[7], u[1], m[3], m[1], c[7], u[5], c[3], c[1]])
+
+class TestKeyDerivation(unittest.TestCase):
+    def test_build_key(self):
+        builder = Key_Builder()
+        for i in range(16):
+            cartridge_key = bytearray(os.urandom(8))
+            eeprom_uid = bytearray(os.urandom(8))
+            assert reference_build_key(cartridge_key, MACHINE_NUMBER, eeprom_uid) == builder.build_key(cartridge_key, MACHINE_NUMBER, eeprom_uid)
+
+    def test_template_cache(self):
+        builder = Key_Builder(cache_size=2)
+        cartridge_key = bytearray(os.urandom(8))
+        for i in range(8):
+            eeprom_uid = bytearray(os.urandom(8))
+            builder.build_key(cartridge_key, MACHINE_NUMBER, eeprom_uid)
+            assert reference_build_key(cartridge_key, MACHINE_NUMBER, EEPROM_UID) == builder.build_key(cartridge_key, MACHINE_NUMBER, EEPROM_UID)
+        assert len(builder.templates) <= 2
+        assert len(builder.machine_parts) == 1
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_build_keys(self):
+        cartridge_keys = numpy.frombuffer(os.urandom(8 * 32), dtype=numpy.uint8).reshape(32, 8)
+        eeprom_uids = numpy.frombuffer(os.urandom(8 * 32), dtype=numpy.uint8).reshape(32, 8)
+
+        keys = key_derivation.build_keys(cartridge_keys, MACHINE_NUMBER, eeprom_uids)
+        assert keys.shape == (32, 16)
+        for i in range(32):
+            assert reference_build_key(cartridge_keys[i].tobytes(), MACHINE_NUMBER, eeprom_uids[i].tobytes()) == bytearray(keys[i].tobytes())
+
+        keys = key_derivation.build_keys(cartridge_keys, MACHINE_NUMBER, EEPROM_UID)
+        assert reference_build_key(cartridge_keys[5].tobytes(), MACHINE_NUMBER, EEPROM_UID) == bytearray(keys[5].tobytes())
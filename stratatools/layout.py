@@ -0,0 +1,306 @@
+#
+# See the LICENSE file
+#
+
+import collections
+import datetime
+import operator
+import re
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from stratatools import material
+
+#
+# Layout of the data on a cartridge EEPROM
+#
+# A layout is a table of fields, each one belonging to a region. A region is
+# a span of the EEPROM covered by checksums and, for some regions, encrypted.
+# The fields of a region are compiled once into a single struct.Struct so the
+# whole region is packed or unpacked in one call.
+#
+
+CRC = struct.Struct("<H")
+
+#
+# Dates (yymmddhhmmss, the year is relative to 1900) are kept as the packed
+# 64 bits integer found on the EEPROM, they are only converted from/to a
+# datetime at the boundaries
+#
+DATE = struct.Struct("<HBBBBH")
+PACKED_DATE = struct.Struct("<Q")
+
+def pack_date(dt):
+    return PACKED_DATE.unpack(DATE.pack(dt.year - 1900, dt.month, dt.day, dt.hour, dt.minute, dt.second))[0]
+
+def unpack_date(value):
+    (year, month, day, hour, minute, second) = DATE.unpack(PACKED_DATE.pack(value))
+    return datetime.datetime(year + 1900, month, day, hour, minute, second)
+
+#
+# Convert an array of packed dates into numpy datetime64[s]
+#
+def unpack_dates(values):
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    year = (values & 0xffff).astype(numpy.int64) + 1900
+    month = ((values >> 16) & 0xff).astype(numpy.int64)
+    day = ((values >> 24) & 0xff).astype(numpy.int64)
+    hour = ((values >> 32) & 0xff).astype(numpy.int64)
+    minute = ((values >> 40) & 0xff).astype(numpy.int64)
+    second = ((values >> 48) & 0xffff).astype(numpy.int64)
+
+    return ((year - 1970).astype("datetime64[Y]")
+        + (month - 1).astype("timedelta64[M]")
+        + (day - 1).astype("timedelta64[D]")
+        + hour.astype("timedelta64[h]")
+        + minute.astype("timedelta64[m]")
+        + second.astype("timedelta64[s]"))
+
+#
+# plain_crc: offset of the checksum of the plaintext region, or None
+# crypted_crc: offset of the checksum of the crypted region, or None
+#
+Region = collections.namedtuple("Region", ["name", "start", "end", "plain_crc", "crypted_crc", "crypted", "label"])
+
+#
+# offset: absolute offset on the EEPROM
+# format: struct format, without byte order
+# codec: converts between the cartridge value and the struct values
+#
+Field = collections.namedtuple("Field", ["name", "offset", "format", "codec", "region"])
+
+#
+# Codecs
+#
+
+#
+# text tells whether the bytes of a "s" format are text, the numpy column
+# then holds a string rather than the raw bytes. column names the numpy
+# column when the stored values are not the field value.
+#
+
+class Codec:
+    text = False
+    column = None
+
+    def encode(self, value):
+        return (value,)
+
+    def decode(self, values):
+        return values[0]
+
+class String_Codec(Codec):
+    text = True
+
+    def __init__(self, strip=False):
+        self.strip = strip
+
+    def encode(self, value):
+        if not isinstance(value, bytes):
+            value = value.encode("latin-1")
+        return (value,)
+
+    def decode(self, values):
+        value = values[0]
+        if self.strip:
+            value = value.split(b"\x00")[0]
+        if not isinstance(value, str):
+            value = value.decode("latin-1")
+        return value
+
+class Material_Codec(Codec):
+    column = "material_id"
+
+    def encode(self, value):
+        return (material.get_id_from_name(value),)
+
+    def decode(self, values):
+        return material.get_name_from_id(int(values[0]))
+
+#
+# A region compiled into a single struct
+#
+class Compiled_Region:
+    def __init__(self, region, fields):
+        self.region = region
+        self.fields = sorted(fields, key=lambda f: f.offset)
+        self.slices = []
+        self.field_structs = {}
+
+        fmt = "<"
+        position = region.start
+        index = 0
+        for field in self.fields:
+            if field.offset < position:
+                raise Exception("field <" + field.name + "> overlaps the previous field")
+            if field.offset > position:
+                fmt += "%dx" % (field.offset - position)
+
+            field_struct = struct.Struct("<" + field.format)
+            count = len(field_struct.unpack(bytearray(field_struct.size)))
+
+            fmt += field.format
+            self.field_structs[field.name] = field_struct
+            self.slices.append((field, index, index + count))
+            position = field.offset + field_struct.size
+            index += count
+
+        if position > region.end:
+            raise Exception("fields overflow region <" + region.name + ">")
+        if position < region.end:
+            fmt += "%dx" % (region.end - position)
+
+        self.struct = struct.Struct(fmt)
+        self.names = [field.name for field in self.fields]
+        self.getter = operator.attrgetter(*self.names)
+
+    #
+    # Pack the fields of the region, read from the cartridge attributes
+    #
+    def pack_into(self, buffer, cartridge):
+        values = self.getter(cartridge)
+        if len(self.fields) == 1:
+            values = (values,)
+
+        packed = []
+        for (field, value) in zip(self.fields, values):
+            packed.extend(field.codec.encode(value))
+
+        self.struct.pack_into(buffer, self.region.start, *packed)
+
+    #
+    # Unpack the fields of the region as a list of (name, value)
+    #
+    def unpack_from(self, buffer):
+        values = self.struct.unpack_from(buffer, self.region.start)
+        return [(field.name, field.codec.decode(values[start:end])) for (field, start, end) in self.slices]
+
+    def pack_field_into(self, buffer, field, value):
+        self.field_structs[field.name].pack_into(buffer, field.offset, *field.codec.encode(value))
+
+    def unpack_field_from(self, buffer, field):
+        return field.codec.decode(self.field_structs[field.name].unpack_from(buffer, field.offset))
+
+class Layout:
+    def __init__(self, size, regions, fields):
+        self.size = size
+        self.regions = collections.OrderedDict((region.name, region) for region in regions)
+        self.fields = collections.OrderedDict((field.name, field) for field in fields)
+
+        self.compiled = collections.OrderedDict()
+        for region in regions:
+            self.compiled[region.name] = Compiled_Region(region, [field for field in fields if field.region == region.name])
+
+        self.dtypes = {}
+
+    def crypted_regions(self):
+        return [region for region in self.regions.values() if region.crypted]
+
+    def pack_region(self, name, buffer, cartridge):
+        self.compiled[name].pack_into(buffer, cartridge)
+
+    def unpack_region(self, name, buffer):
+        return self.compiled[name].unpack_from(buffer)
+
+    #
+    # numpy structured dtype of an image: one column per field, named after
+    # the field, and one per checksum, named <region>_crc and
+    # <region>_crypted_crc
+    #
+    # Columns hold the stored values, not decoded: the material is the float
+    # identifier in a material_id column, binary strings like key_fragment
+    # are raw bytes keeping their trailing zeros.
+    #
+    # itemsize is the distance between two images in a dump, the layout size
+    # by default.
+    #
+    def get_dtype(self, itemsize=None):
+        if numpy is None:
+            raise Exception("numpy is required to build a dtype")
+
+        if itemsize is None:
+            itemsize = self.size
+        if itemsize < self.size:
+            raise Exception("itemsize must be at least " + str(self.size))
+
+        if itemsize not in self.dtypes:
+            names = []
+            formats = []
+            offsets = []
+            for field in self.fields.values():
+                names.append(field.codec.column or field.name)
+                formats.append(_numpy_format(field.format, field.codec.text))
+                offsets.append(field.offset)
+            for region in self.regions.values():
+                if region.plain_crc is not None:
+                    names.append(region.name + "_crc")
+                    formats.append("<u2")
+                    offsets.append(region.plain_crc)
+                if region.crypted_crc is not None:
+                    names.append(region.name + "_crypted_crc")
+                    formats.append("<u2")
+                    offsets.append(region.crypted_crc)
+
+            self.dtypes[itemsize] = numpy.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": itemsize})
+
+        return self.dtypes[itemsize]
+
+    def get_field(self, name):
+        if name not in self.fields:
+            raise Exception("unknown field <" + name + ">")
+        return self.fields[name]
+
+    def pack_field(self, name, buffer, value):
+        field = self.get_field(name)
+        self.compiled[field.region].pack_field_into(buffer, field, value)
+
+    def unpack_field(self, name, buffer):
+        field = self.get_field(name)
+        return self.compiled[field.region].unpack_field_from(buffer, field)
+
+# Struct format to numpy format, "20s" -> "S20", "H" -> "<H"
+def _numpy_format(fmt, text=True):
+    (count, code) = re.match(r"^(\d*)(\w)$", fmt).groups()
+    if code == "s":
+        return ("S" if text else "V") + (count or "1")
+    if count:
+        return count + "<" + code
+    return "<" + code
+
+#
+# Typical structure on the EEPROM
+#
+#   The checksums of the crypted regions are computed on the plaintext and on
+#   the ciphertext, the key is stored unencrypted.
+#
+#   ~~~~~~~~~~~~~
+#   14 0x00: 0x48 - crypted/plaintext (start, len)
+#   15 0x58: 0x10 - unknown, looks like DEX IV, but why?
+#   16 0x48: 0x10 - ^
+#
+CARTRIDGE = Layout(0x71,
+    regions=[
+        Region("content", 0x00, 0x40, plain_crc=0x40, crypted_crc=0x46, crypted=True, label="content"),
+        Region("key", 0x48, 0x50, plain_crc=0x50, crypted_crc=None, crypted=False, label="key"),
+        Region("quantity", 0x58, 0x60, plain_crc=0x62, crypted_crc=0x60, crypted=True, label="current material quantity"),
+        Region("signature", 0x68, 0x71, plain_crc=None, crypted_crc=None, crypted=False, label="signature"),
+    ],
+    fields=[
+        # Canister serial number (part of the key, written *on* the canister as S/N)
+        Field("serial_number", 0x00, "d", Codec(), "content"),
+        Field("material_name", 0x08, "d", Material_Codec(), "content"),
+        Field("manufacturing_lot", 0x10, "20s", String_Codec(strip=True), "content"),
+        # Version? (must be 1)
+        Field("version", 0x24, "H", Codec(), "content"),
+        Field("manufacturing_date", 0x28, "Q", Codec(), "content"),
+        Field("last_use_date", 0x30, "Q", Codec(), "content"),
+        Field("initial_material_quantity", 0x38, "d", Codec(), "content"),
+        Field("key_fragment", 0x48, "8s", Codec(), "key"),
+        Field("current_material_quantity", 0x58, "d", Codec(), "quantity"),
+        # Signature (not sure, not used)
+        Field("signature", 0x68, "9s", String_Codec(), "signature"),
+    ])
@@ -3,6 +3,10 @@
 #
 
 import binascii
+import collections
+import os
+
+from stratatools import key_derivation
 
 #
 # A machine is a printer from stratasys
@@ -17,17 +21,98 @@ type_to_number = {
     "uprintse": "09FBD4B61FC0B327",
 }
 
-number_to_type = {}
+#
+# Registry of the machines
+#
+# number is the decoded 8 bytes machine number and key_part the key bytes it
+# gives (see key_derivation.machine_part), both computed once when the
+# machine is added so lookups never decode hexadecimal.
+#
+# More machines can be loaded from a file with load_machines(), or from the
+# file named by the STRATATOOLS_MACHINES environment variable the first time
+# the registry is used. Each line holds a type and a hexadecimal number, e.g.
+# 'fox3 2C3047ABB7DE81E8', lines starting with '#' are ignored.
+#
+Machine = collections.namedtuple("Machine", ["type", "number", "key_part"])
+
+MACHINES_ENVIRONMENT_VARIABLE = "STRATATOOLS_MACHINES"
+
+machines = collections.OrderedDict()
+number_to_machine = {}
+
+environment_loaded = False
+
+def add_machine(type, number):
+    number = bytes(number)
+
+    if len(number) != 8:
+        raise Exception("machine number of <" + type + "> must be 8 bytes, got " + str(len(number)))
+    if type in machines and machines[type].number != number:
+        raise Exception("machine <" + type + "> already has the number " + binascii.hexlify(machines[type].number).decode("ascii"))
+    if number in number_to_machine and number_to_machine[number].type != type:
+        raise Exception("machine number " + binascii.hexlify(number).decode("ascii") + " is already used by <" + number_to_machine[number].type + ">")
+
+    m = Machine(type, number, key_derivation.machine_part(number))
+    machines[type] = m
+    number_to_machine[number] = m
+    return m
+
+def load_machines(f):
+    for (line_number, line) in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            (type, number) = line.split()
+            number = binascii.unhexlify(number)
+        except (ValueError, TypeError, binascii.Error):
+            raise Exception("line " + str(line_number) + ": expected a machine type and a hexadecimal number, got <" + line + ">")
+
+        add_machine(type, number)
+
+def load_environment():
+    global environment_loaded
+
+    if environment_loaded:
+        return
+    environment_loaded = True
+
+    path = os.environ.get(MACHINES_ENVIRONMENT_VARIABLE)
+    if path:
+        with open(path, "r") as f:
+            load_machines(f)
+
+def add_known_machines():
+    for (machine_type, number) in sorted(type_to_number.items()):
+        add_machine(machine_type, binascii.unhexlify(number))
+
+add_known_machines()
+
+def get_machines():
+    load_environment()
+    return list(machines.values())
 
 def get_machine_types():
-    return type_to_number.keys()
+    load_environment()
+    return list(machines.keys())
+
+def get_machine(type):
+    load_environment()
+    try:
+        return machines[type]
+    except KeyError:
+        raise Exception("unknown machine type <" + type + ">")
+
+def get_machine_from_number(number):
+    load_environment()
+    try:
+        return number_to_machine[bytes(number)]
+    except KeyError:
+        raise Exception("unknown machine number " + binascii.hexlify(bytes(number)).decode("ascii"))
 
 def get_number_from_type(type):
-    return type_to_number[type].decode("hex")
+    return get_machine(type).number
 
 def get_type_from_number(number):
-    if len(number_to_type) == 0:
-        for key, value in enumerate(type_to_number):
-            number_to_type[value] = key
-
-    return number_to_type[binascii.hexlify(number)]
+    return get_machine_from_number(number).type
@@ -0,0 +1,37 @@
+import binascii
+import io
+import unittest
+from stratatools import key_derivation
+from stratatools import machine
+
+class TestMachine(unittest.TestCase):
+    def test_registry(self):
+        fox = machine.get_machine("fox")
+
+        assert fox.number == binascii.unhexlify("2C30478BB7DE81E8")
+        assert fox.key_part == key_derivation.machine_part(fox.number)
+        assert machine.get_number_from_type("fox") == fox.number
+
+        for m in machine.get_machines():
+            assert machine.get_type_from_number(m.number) == m.type
+            assert machine.get_type_from_number(bytearray(m.number)) == m.type
+
+        assert "uprintse" in machine.get_machine_types()
+        self.assertRaises(Exception, machine.get_machine, "makerbot")
+        self.assertRaises(Exception, machine.get_type_from_number, bytearray(8))
+
+    def test_load_machines(self):
+        try:
+            machine.load_machines(io.StringIO(u"# new printers\n\ntest 0011223344556677\n"))
+
+            m = machine.get_machine("test")
+            assert m.number == binascii.unhexlify("0011223344556677")
+            assert machine.get_type_from_number(m.number) == "test"
+            assert "test" in machine.get_machine_types()
+        finally:
+            del machine.number_to_machine[machine.machines.pop("test").number]
+
+        self.assertRaises(Exception, machine.load_machines, io.StringIO(u"fox 0011223344556677\n"))
+        self.assertRaises(Exception, machine.load_machines, io.StringIO(u"test 2C30478BB7DE81E8\n"))
+        self.assertRaises(Exception, machine.load_machines, io.StringIO(u"test 00112233\n"))
+        self.assertRaises(Exception, machine.load_machines, io.StringIO(u"test zz\n"))
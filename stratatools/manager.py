@@ -2,248 +2,500 @@
 # See the LICENSE file
 #
 
-import datetime
-import struct
+import collections
 import time
 
-import cartridge_pb2
-import material
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from stratatools import buffers
+from stratatools.buffers import diff_ranges
+from stratatools import cartridge_pb2
+from stratatools import key_derivation
+from stratatools import layout
+from stratatools import machine
+from stratatools.cartridge import Cartridge_Record
 
 #
 # CartridgeManager is used to create, encrypt and decrypt Stratasys cartridge
 #
-# Typical structure on the EEPROM
-#        offset : len
-#        0x00   : 0x08 - Canister serial number (double) (part of the key, written *on* the canister as S/N)
-#        0x08   : 0x08 - Material type (double)
-#        0x10   : 0x14 - Manufacturing lot (string)
-#        0x24   : 0x02 - Version? (must be 1)
-#        0x28   : 0x08 - Manufacturing date (date yymmddhhmmss)
-#        0x30   : 0x08 - Use date (date yymmddhhmmss)
-#        0x38   : 0x08 - Initial material quantity (double)
-#        0x40   : 0x02 - Plain content CRC (uint16)
-#        0x46   : 0x02 - Crypted content CRC (uint16)
-#        0x48   : 0x08 - Key (unencrypted, 8 bytes)
-#        0x50   : 0x02 - Key CRC (unencrypted, uint16)
-#        0x58   : 0x08 - Current material quantity (double)
-#        0x60   : 0x02 - Current material quantity crypted CRC (unencrypted, uint16)
-#        0x62   : 0x02 - Current material quantity CRC (unencrypted, uint16)
-#       ~~~~~~~~~~~~~
-#       14 0x00: 0x48 - crypted/plaintext (start, len)
-#       15 0x58: 0x10 - unknown, looks like DEX IV, but why?
-#       16 0x48: 0x10 - ^
+# The structure of the EEPROM is described by a layout, see layout.py
+#
+
+#
+# Result of one item of a batch: the encoded or decoded value, or the error
+# that prevented it
+#
+Batch_Result = collections.namedtuple("Batch_Result", ["value", "error"])
+
+#
+# Result of a probe: the machine and eeprom uid that decrypt the cartridge
+# (None if nothing matched), the number of candidates tried and the time
+# spent, in seconds
+#
+Probe_Result = collections.namedtuple("Probe_Result", ["machine_type", "machine_number", "eeprom_uid", "tried", "elapsed"])
+
+# EEPROM family codes that are mixed up
+UID_FAMILY_CODES = {0x23: 0xb3, 0xb3: 0x23}
+
+#
+# Variants of an eeprom uid: the uid itself, the uid with the other family
+# code, then the same for the uid in reverse byte order
+#
+def eeprom_uid_variants(eeprom_uid):
+    variants = []
+    for uid in (bytearray(eeprom_uid), bytearray(reversed(bytearray(eeprom_uid)))):
+        for candidate in (uid, _swap_family_code(uid)):
+            if candidate is not None and candidate not in variants:
+                variants.append(candidate)
+    return [bytes(uid) for uid in variants]
+
+def _swap_family_code(eeprom_uid):
+    if eeprom_uid[0] not in UID_FAMILY_CODES:
+        return None
+    uid = bytearray(eeprom_uid)
+    uid[0] = UID_FAMILY_CODES[uid[0]]
+    return uid
+
+#
+# Lazy view over a crypted cartridge
+#
+# A region is decrypted and validated the first time one of its fields is
+# read, and each field is unpacked once. The cartridge record is only built
+# by to_record() or to_proto().
+#
+class Cartridge_View:
+    def __init__(self, manager, machine_number, eeprom_uid, cartridge_crypted):
+        self.manager = manager
+        self.machine_number = machine_number
+        self.eeprom_uid = eeprom_uid
+        self.cartridge = bytearray(cartridge_crypted)
+        self.key = None
+        self.decrypted = set()
+        self.validated = set()
+        self.values = {}
+
+    # Only called for the names that are not attributes of the view
+    def __getattr__(self, name):
+        manager = self.__dict__.get("manager")
+        if manager is None or name not in manager.layout.fields:
+            raise AttributeError(name)
+        return self.get(name)
+
+    def get(self, name):
+        if name not in self.values:
+            field = self.manager.layout.get_field(name)
+            self._decrypt_region(self.manager.layout.regions[field.region])
+            self.values[name] = self.manager.layout.unpack_field(name, self.cartridge)
+        return self.values[name]
+
+    def to_record(self):
+        for region in self.manager.layout.crypted_regions():
+            self._decrypt_region(region)
+        return self.manager.unpack(self.cartridge)
+
+    def to_proto(self):
+        return self.to_record().to_proto()
+
+    # A region is decrypted once, recorded, then validated, so a failed
+    # validation keeps failing the same way instead of decrypting again
+    def _decrypt_region(self, region):
+        if not region.crypted or region.name in self.validated:
+            return
+        if region.name not in self.decrypted:
+            if self.key is None:
+                self.key = self.manager._get_key(self.machine_number, self.eeprom_uid, self.cartridge)
+            self.manager._decrypt_region(self.key, region, self.cartridge, validate_plain=False)
+            self.decrypted.add(region.name)
+        self.manager._validate_region(region, self.cartridge)
+        self.validated.add(region.name)
 
 class Manager:
-    def __init__(self, crypto, checksum):
+    def __init__(self, crypto, checksum, cartridge_layout=layout.CARTRIDGE, pool=None):
         self.crypto = crypto
         self.checksum = checksum
+        self.layout = cartridge_layout
+        self.pool = pool if pool is not None else buffers.Buffer_Pool()
+        self.padding = b"\x00" * (self.pool.size - self.layout.size)
+        self.blank = b"\x00" * self.layout.size
+        self.key_builder = key_derivation.Key_Builder(machine_parts=dict((known.number, known.key_part) for known in machine.get_machines()))
 
     #
     # Encode a cartridge object into a data that can be burn onto a cartridge
     #
-    def encode(self, machine_number, eeprom_uid, cartridge):
-        cartridge_packed = self.pack(cartridge)
-        cartridge_crypted = self.encrypt(machine_number, eeprom_uid, cartridge_packed)
+    # The image is written into out when given (a bytearray or a writable
+    # memoryview, at least the layout size, e.g. a whole 512 bytes EEPROM
+    # buffer), without intermediate copies. Bytes past the layout are left
+    # untouched.
+    #
+    def encode(self, machine_number, eeprom_uid, cartridge, out=None):
+        cartridge_packed = self.pack(cartridge, out)
+        cartridge_crypted = self.encrypt(machine_number, eeprom_uid, cartridge_packed, out=cartridge_packed)
         return cartridge_crypted
 
     #
     # Decode a eeprom to a cartridge object
     #
-    def decode(self, machine_number, eeprom_uid, cartridge_crypted):
-        cartridge_packed = self.decrypt(machine_number, eeprom_uid, cartridge_crypted)
+    # The image is decrypted into out when given, the input is never
+    # modified.
+    #
+    def decode(self, machine_number, eeprom_uid, cartridge_crypted, out=None):
+        cartridge_packed = self.decrypt(machine_number, eeprom_uid, cartridge_crypted, out)
         cartridge = self.unpack(cartridge_packed)
         return cartridge
 
+    #
+    # Encode into an EEPROM sized buffer drawn from the pool, zero padded
+    # past the layout, to be given back with release() once written
+    #
+    def encode_into(self, machine_number, eeprom_uid, cartridge):
+        eeprom = self.pool.acquire()
+        try:
+            eeprom[self.layout.size:] = self.padding
+            return self.encode(machine_number, eeprom_uid, cartridge, out=eeprom)
+        except Exception:
+            self.pool.release(eeprom)
+            raise
+
+    #
+    # Decode using a working buffer drawn from the pool and given back
+    #
+    def decode_into(self, machine_number, eeprom_uid, cartridge_crypted):
+        with self.pool.buffer() as cartridge_packed:
+            return self.decode(machine_number, eeprom_uid, cartridge_crypted, out=cartridge_packed)
+
+    def release(self, eeprom):
+        self.pool.release(eeprom)
+
+    #
+    # Lazy view over a crypted cartridge, see Cartridge_View
+    #
+    def view(self, machine_number, eeprom_uid, cartridge_crypted):
+        return Cartridge_View(self, machine_number, eeprom_uid, cartridge_crypted)
+
+    #
+    # Encode (machine_number, eeprom_uid, cartridge) items, yielding one
+    # Batch_Result per item, in order
+    #
+    # Key contexts and checksum tables are shared by every item of the batch.
+    #
+    def encode_many(self, items):
+        for (machine_number, eeprom_uid, cartridge) in items:
+            try:
+                yield Batch_Result(self.encode(machine_number, eeprom_uid, cartridge), None)
+            except Exception as e:
+                yield Batch_Result(None, e)
+
+    #
+    # Decode (machine_number, eeprom_uid, cartridge_crypted) items, yielding
+    # one Batch_Result per item, in order
+    #
+    # Each item is decrypted in the same working buffer, the input is left
+    # untouched.
+    #
+    def decode_many(self, items):
+        cartridge_buffer = bytearray(self.layout.size)
+
+        for (machine_number, eeprom_uid, cartridge_crypted) in items:
+            try:
+                yield Batch_Result(self.decode(machine_number, eeprom_uid, cartridge_crypted, out=cartridge_buffer), None)
+            except Exception as e:
+                yield Batch_Result(None, e)
+
+    #
+    # View a contiguous block of decrypted images as a numpy record array,
+    # without copying, see Layout.get_dtype for the columns
+    #
+    # image_size is the distance between two images, the layout size by
+    # default. Returns (records, valid), valid telling for each image whether
+    # the plaintext checksums of its crypted regions match.
+    #
+    def decode_columns(self, buffer, image_size=None):
+        if numpy is None:
+            raise Exception("numpy is required to decode columns")
+
+        dtype = self.layout.get_dtype(image_size)
+        records = numpy.frombuffer(buffer, dtype=dtype).view(numpy.recarray)
+        images = numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(len(records), dtype.itemsize)
+
+        valid = numpy.ones(len(records), dtype=bool)
+        for region in self.layout.crypted_regions():
+            valid &= self.checksum.checksum_batch(images[:, region.start:region.end]) == records[region.name + "_crc"]
+
+        return (records, valid)
+
+    #
+    # Find the machine and eeprom uid a crypted cartridge was made for
+    #
+    # machines is a list of (machine_type, machine_number), every eeprom uid
+    # variant is tried with each of them. The ciphertext checksum does not
+    # depend on the key, it is validated once. Each candidate then only
+    # decrypts the content region, the probe stops at the first one whose
+    # plaintext checksum matches.
+    #
+    # With a batch crypto (Desx_Batch_Crypto), candidates are decrypted
+    # batch_size at a time by the vectorized DES.
+    #
+    def probe(self, eeprom_uid, cartridge_crypted, machines, batch_size=8):
+        start = time.time()
+
+        cartridge_crypted = bytearray(cartridge_crypted)
+        region = self.layout.regions["content"]
+        ciphertext = cartridge_crypted[region.start:region.end]
+
+        if self.checksum.checksum(ciphertext) != layout.CRC.unpack_from(cartridge_crypted, region.crypted_crc)[0]:
+            raise Exception("invalid crypted " + region.label + " checksum")
+        expected = layout.CRC.unpack_from(cartridge_crypted, region.plain_crc)[0]
+
+        # Only uid bytes 1, 2, 5 and 6 are part of the key, variants giving a
+        # key already tried are skipped
+        candidates = []
+        keys = set()
+        for uid in eeprom_uid_variants(eeprom_uid):
+            for (machine_type, machine_number) in machines:
+                key = bytes(self._get_key(machine_number, uid, cartridge_crypted))
+                if key not in keys:
+                    keys.add(key)
+                    candidates.append((machine_type, bytes(machine_number), uid, key))
+
+        if numpy is not None and hasattr(self.crypto, "decrypt_batch"):
+            step = batch_size
+        else:
+            step = 1
+
+        tried = 0
+        for i in range(0, len(candidates), step):
+            chunk = candidates[i:i + step]
+
+            if step == 1:
+                crcs = [self.checksum.checksum(self.crypto.decrypt(chunk[0][3], ciphertext))]
+            else:
+                keys = numpy.frombuffer(b"".join(candidate[3] for candidate in chunk), dtype=numpy.uint8).reshape(len(chunk), 16)
+                ciphertexts = numpy.tile(numpy.frombuffer(bytes(ciphertext), dtype=numpy.uint8), (len(chunk), 1))
+                plaintexts = self.crypto.decrypt_batch(keys, ciphertexts)
+                crcs = self.checksum.checksum_batch(plaintexts)
+
+            for (candidate, crc) in zip(chunk, crcs):
+                tried += 1
+                if crc == expected:
+                    return Probe_Result(candidate[0], candidate[1], candidate[2], tried, time.time() - start)
+
+        return Probe_Result(None, None, None, tried, time.time() - start)
+
+    #
+    # Read a single field of a crypted cartridge, only its region is
+    # decrypted
+    #
+    def read_field(self, machine_number, eeprom_uid, cartridge_crypted, name):
+        field = self.layout.get_field(name)
+        region = self.layout.regions[field.region]
+
+        cartridge_packed = bytearray(cartridge_crypted)
+        if region.crypted:
+            key = self._get_key(machine_number, eeprom_uid, cartridge_packed)
+            self._decrypt_region(key, region, cartridge_packed)
+
+        return self.layout.unpack_field(name, cartridge_packed)
+
+    #
+    # Update some fields of a crypted cartridge in place, fields being a
+    # dict of field name to value
+    #
+    # Only the regions holding those fields are decrypted, re-encrypted and
+    # checksummed again, unless the key fragment changes. Their checksums are
+    # patched from the bytes that changed rather than computed again over the
+    # whole region, so the stored ones are validated first. Returns the
+    # (start, end) byte ranges that changed, so only those have to be written.
+    #
+    def patch(self, machine_number, eeprom_uid, cartridge_crypted, fields):
+        regions = set(self.layout.get_field(name).region for name in fields)
+        if "key" in regions:
+            # A new key fragment changes the key of every crypted region
+            regions.update(region.name for region in self.layout.crypted_regions())
+        regions = [region for region in self.layout.regions.values() if region.name in regions]
+
+        cartridge_packed = bytearray(cartridge_crypted)
+
+        key = self._get_key(machine_number, eeprom_uid, cartridge_packed)
+        for region in regions:
+            if region.crypted:
+                self._decrypt_region(key, region, cartridge_packed)
+            elif region.plain_crc is not None:
+                self._validate_region(region, cartridge_packed)
+
+        plain = bytearray(cartridge_packed)
+        for (name, value) in fields.items():
+            self.layout.pack_field(name, cartridge_packed, value)
+
+        for region in regions:
+            if region.plain_crc is not None:
+                self._patch_crc(region, region.plain_crc, plain, cartridge_packed)
+
+        key = self._get_key(machine_number, eeprom_uid, cartridge_packed)
+        for region in regions:
+            if region.crypted:
+                self._encrypt_region(key, region, cartridge_packed, cartridge_crypted)
+
+        changes = diff_ranges(cartridge_crypted, cartridge_packed)
+        for (start, end) in changes:
+            cartridge_crypted[start:end] = cartridge_packed[start:end]
+
+        return changes
+
+    #
+    # Update the current material quantity, touching only its 8 bytes block
+    # and checksums
+    #
+    def patch_quantity(self, machine_number, eeprom_uid, cartridge_crypted, quantity):
+        return self.patch(machine_number, eeprom_uid, cartridge_crypted, {"current_material_quantity": quantity})
+
     #
     # Pack a cartridge into a format suitable to be encrypted then burn
     # onto the cartridge EEPROM
     #
-    def pack(self, cartridge):
-        eeprom = bytearray(0x71)
-
-        # serial number
-        struct.pack_into("<d", eeprom, 0x0, cartridge.serial_number)
-        # material id
-        struct.pack_into("<d", eeprom, 0x08, material.get_id_from_name(cartridge.material_name))
-        # manufacturing lot
-        struct.pack_into("<20s", eeprom, 0x10, str(cartridge.manufacturing_lot))
-        # version (not sure)
-        struct.pack_into("<H", eeprom, 0x24, cartridge.version)
-        # manufacturing date
-        mfg_dt = cartridge.manufacturing_date.ToDatetime()
-        struct.pack_into("<HBBBBH", eeprom, 0x28,
-                mfg_dt.year - 1900,
-                mfg_dt.month,
-                mfg_dt.day,
-                mfg_dt.hour,
-                mfg_dt.minute,
-                mfg_dt.second)
-        # last use date
-        lu_dt = cartridge.last_use_date.ToDatetime()
-        struct.pack_into("<HBBBBH", eeprom, 0x30,
-                lu_dt.year - 1900,
-                lu_dt.month,
-                lu_dt.day,
-                lu_dt.hour,
-                lu_dt.minute,
-                lu_dt.second)
-        struct.pack_into("<d", eeprom, 0x38, cartridge.initial_material_quantity)
-        # plaintext checksum
-        struct.pack_into("<H", eeprom, 0x40, self.checksum.checksum(eeprom[0x00:0x40]))
-        # key
-        struct.pack_into("<8s", eeprom, 0x48, str(cartridge.key_fragment.decode("hex")))
-        # key checksum
-        struct.pack_into("<H", eeprom, 0x50, self.checksum.checksum(eeprom[0x48:0x50]))
-        # current material quantity
-        struct.pack_into("<d", eeprom, 0x58, cartridge.current_material_quantity)
-        # Checksum current material quantity
-        struct.pack_into("<H", eeprom, 0x62, self.checksum.checksum(eeprom[0x58:0x60]))
-        # signature (not sure, not usedu)
-        struct.pack_into("<9s", eeprom, 0x68, str(cartridge.signature))
+    # The cartridge is a Cartridge_Record, a protobuf cartridge is converted
+    # first. The image is packed into out when given.
+    #
+    def pack(self, cartridge, out=None):
+        if isinstance(cartridge, cartridge_pb2.Cartridge):
+            cartridge = Cartridge_Record.from_proto(cartridge)
+
+        if out is None:
+            eeprom = bytearray(self.layout.size)
+        else:
+            eeprom = out
+            eeprom[0:self.layout.size] = self.blank
+
+        view = memoryview(eeprom)
+        for region in self.layout.regions.values():
+            self.layout.pack_region(region.name, eeprom, cartridge)
+            if region.plain_crc is not None:
+                layout.CRC.pack_into(eeprom, region.plain_crc, self.checksum.checksum(view[region.start:region.end]))
 
         return eeprom
 
     #
-    # Unpack a decrypted cartridge into a catridge object
+    # Unpack a decrypted cartridge into a Cartridge_Record
     #
     def unpack(self, cartridge_packed):
-        # Validating plaintext checksum
-        if self.checksum.checksum(cartridge_packed[0x00:0x40]) != struct.unpack("<H", str(cartridge_packed[0x40:0x42]))[0]:
-            raise Exception("invalid content checksum: should have " + hex(struct.unpack("<H", str(cartridge_packed[0x40:0x42]))[0]) + " but have " + hex(self.checksum.checksum(cartridge_packed[0x00:0x40])))
-
-        # Validating current material quantity checksum
-        if self.checksum.checksum(cartridge_packed[0x58:0x60]) != struct.unpack("<H", str(cartridge_packed[0x62:0x64]))[0]:
-            raise Exception("invalid current material quantity checksum")
-
-        cartridge_packed = buffer(cartridge_packed)
-
-        # Serial number
-        serial_number = struct.unpack_from("<d", cartridge_packed, 0x0)[0]
-        # Material
-        material_name = material.get_name_from_id(int(struct.unpack_from("<d", cartridge_packed, 0x08)[0]))
-        # Manufacturing lot
-        manufacturing_lot = struct.unpack_from("<20s", cartridge_packed, 0x10)[0].split('\x00')[0]
-        # Manufacturing datetime
-        (mfg_datetime_year,
-            mfg_datetime_month,
-            mfg_datetime_day,
-            mfg_datetime_hour,
-            mfg_datetime_minute,
-            mfg_datetime_second) = struct.unpack_from("<HBBBBH", cartridge_packed, 0x28)
-        mfg_datetime = datetime.datetime(mfg_datetime_year + 1900,
-                mfg_datetime_month,
-                mfg_datetime_day,
-                mfg_datetime_hour,
-                mfg_datetime_minute,
-                mfg_datetime_second)
-        # Last use datetime
-        (use_datetime_year,
-            use_datetime_month,
-            use_datetime_day,
-            use_datetime_hour,
-            use_datetime_minute,
-            use_datetime_second) = struct.unpack_from("<HBBBBH", cartridge_packed, 0x30)
-        use_datetime = datetime.datetime(use_datetime_year + 1900,
-                use_datetime_month,
-                use_datetime_day,
-                use_datetime_hour,
-                use_datetime_minute,
-                use_datetime_second)
-        # Initial material quantity
-        initial_material_quantity = struct.unpack_from("<d", cartridge_packed, 0x38)[0]
-        # Version
-        version = struct.unpack_from("<H", cartridge_packed, 0x24)[0]
-        # Key fragment
-        key_fragment = str(struct.unpack_from("<8s", cartridge_packed, 0x48)[0]).encode("hex")
-        # Current material quantity
-        current_material_quantity = struct.unpack_from("<d", cartridge_packed, 0x58)[0]
-        # Signature
-        signature = struct.unpack_from("<9s", cartridge_packed, 0x68)[0]
-
-        c = cartridge_pb2.Cartridge()
-        c.serial_number = serial_number
-        c.material_name = material_name
-        c.manufacturing_lot = manufacturing_lot
-        c.manufacturing_date.FromDatetime(mfg_datetime)
-        c.last_use_date.FromDatetime(use_datetime)
-        c.initial_material_quantity = initial_material_quantity
-        c.current_material_quantity = current_material_quantity
-        c.key_fragment = key_fragment
-        c.version = version
-        c.signature = signature
+        # Validating plaintext checksums, they tell whether the decryption
+        # succeeded
+        for region in self.layout.crypted_regions():
+            self._validate_region(region, cartridge_packed)
+
+        c = Cartridge_Record.__new__(Cartridge_Record)
+        for region in self.layout.regions.values():
+            for (name, value) in self.layout.unpack_region(region.name, cartridge_packed):
+                setattr(c, name, value)
 
         return c
 
     #
     # Encrypt a packed cartridge into a crypted cartridge
     #
-    def encrypt(self, machine_number, eeprom_uid, cartridge_packed):
-        cartridge_crypted = cartridge_packed
+    # Into a copy of the packed cartridge, or into out, which may be the
+    # packed cartridge itself to encrypt in place
+    #
+    def encrypt(self, machine_number, eeprom_uid, cartridge_packed, out=None):
+        cartridge_crypted = self._get_output(cartridge_packed, out)
 
         # Validate key fragment checksum
         # TODO
 
-        # Build the key
-        key = self.build_key(cartridge_packed[0x48:0x50], machine_number, eeprom_uid)
-        # Encrypt content
-        struct.pack_into("<64s", cartridge_crypted, 0x00, str(self.crypto.encrypt(key, cartridge_packed[0x00:0x40])))
-        # Checksum crypted content
-        struct.pack_into("<H", cartridge_crypted, 0x46, self.checksum.checksum(cartridge_packed[0x00:0x40]))
-        # Encrypt current material quantity
-        struct.pack_into("<8s", cartridge_crypted, 0x58, str(self.crypto.encrypt(key, cartridge_packed[0x58:0x60])))
-        # Checksum crypted current material quantity
-        struct.pack_into("<H", cartridge_crypted, 0x60, self.checksum.checksum(cartridge_packed[0x58:0x60]))
+        key = self._get_key(machine_number, eeprom_uid, cartridge_packed)
+        for region in self.layout.crypted_regions():
+            self._encrypt_region(key, region, cartridge_crypted)
 
         return cartridge_crypted
 
     #
     # Decrypt a crypted cartridge into a packed cartridge
     #
-    def decrypt(self, machine_number, eeprom_uid, cartridge_crypted):
-        cartridge_packed = cartridge_crypted
+    # Into a copy of the crypted cartridge, or into out, which may be the
+    # crypted cartridge itself to decrypt in place
+    #
+    def decrypt(self, machine_number, eeprom_uid, cartridge_crypted, out=None):
+        cartridge_packed = self._get_output(cartridge_crypted, out)
 
         # Validate key fragment checksum
         # TODO
 
-        # Build the key
-        key = self.build_key(cartridge_crypted[0x48:0x50], machine_number, eeprom_uid)
-        # Validate crypted content checksum
-        if self.checksum.checksum(cartridge_crypted[0x00:0x40]) != struct.unpack("<H", str(cartridge_crypted[0x46:0x48]))[0]:
-            raise Exception("invalid crypted content checksum")
-        # Decrypt content
-        cartridge_packed[0x00:0x40] = self.crypto.decrypt(key, cartridge_crypted[0x00:0x40])
-        # Validate crypted current material quantity checksum
-        if self.checksum.checksum(cartridge_crypted[0x58:0x60]) != struct.unpack("<H", str(cartridge_crypted[0x60:0x62]))[0]:
-            raise Exception("invalid current material quantity checksum")
-        # Decrypt current material quantity
-        cartridge_packed[0x58:0x60] = self.crypto.decrypt(key, cartridge_crypted[0x58:0x60])
+        key = self._get_key(machine_number, eeprom_uid, cartridge_packed)
+        for region in self.layout.crypted_regions():
+            self._decrypt_region(key, region, cartridge_packed, validate_plain=False)
 
         return cartridge_packed
 
+    def _get_output(self, cartridge, out):
+        if out is None:
+            return bytearray(cartridge)
+        if out is not cartridge:
+            out[0:self.layout.size] = cartridge[0:self.layout.size]
+        return out
+
+    #
+    # Build the key from the key fragment of a cartridge
+    #
+    def _get_key(self, machine_number, eeprom_uid, cartridge):
+        key_region = self.layout.regions["key"]
+        return self.build_key(cartridge[key_region.start:key_region.end], machine_number, eeprom_uid)
+
+    #
+    # Encrypt a region in place then checksum the ciphertext
+    #
+    # When the previous ciphertext is given, its checksum, still stored in
+    # the cartridge, is patched instead.
+    #
+    def _encrypt_region(self, key, region, cartridge, previous=None):
+        data = memoryview(cartridge)[region.start:region.end]
+        self.crypto.encrypt(key, data, out=data)
+        if previous is None:
+            layout.CRC.pack_into(cartridge, region.crypted_crc, self.checksum.checksum(data))
+        else:
+            self._patch_crc(region, region.crypted_crc, previous, cartridge)
+
+    #
+    # Update the checksum at offset of a region from old to new, both whole
+    # cartridges, from the byte ranges of the region that changed. The
+    # checksum stored in new must still be the one of old.
+    #
+    def _patch_crc(self, region, offset, old, new):
+        if not hasattr(self.checksum, "patch"):
+            layout.CRC.pack_into(new, offset, self.checksum.checksum(memoryview(new)[region.start:region.end]))
+            return
+
+        old = bytearray(old[region.start:region.end])
+        new_region = bytearray(new[region.start:region.end])
+
+        crc = layout.CRC.unpack_from(new, offset)[0]
+        for (start, end) in diff_ranges(old, new_region):
+            crc = self.checksum.patch(crc, old[start:end], new_region[start:end], len(new_region) - end)
+        layout.CRC.pack_into(new, offset, crc)
+
+    #
+    # Validate the ciphertext checksum then decrypt a region in place,
+    # optionally validating the plaintext checksum as well
+    #
+    def _decrypt_region(self, key, region, cartridge, validate_plain=True):
+        data = memoryview(cartridge)[region.start:region.end]
+        if self.checksum.checksum(data) != layout.CRC.unpack_from(cartridge, region.crypted_crc)[0]:
+            raise Exception("invalid crypted " + region.label + " checksum")
+
+        self.crypto.decrypt(key, data, out=data)
+
+        if validate_plain:
+            self._validate_region(region, cartridge)
+
+    def _validate_region(self, region, cartridge_packed):
+        expected = layout.CRC.unpack_from(cartridge_packed, region.plain_crc)[0]
+        actual = self.checksum.checksum(memoryview(cartridge_packed)[region.start:region.end])
+        if expected != actual:
+            raise Exception("invalid " + region.label + " checksum: should have " + hex(expected) + " but have " + hex(actual))
+
     #
     # Build a key used to encrypt/decrypt a cartridge
     #
     def build_key(self, cartridge_key, machine_number, eeprom_uid):
-        machine_number = bytearray(machine_number)
-        eeprom_uid = bytearray(eeprom_uid)
-        key = bytearray(16)
-
-        key[0] = ~cartridge_key[0] & 0xff
-        key[1] = ~cartridge_key[2] & 0xff
-        key[2] = ~eeprom_uid[2] & 0xff
-        key[3] = ~cartridge_key[6] & 0xff
-        key[4] = ~machine_number[0] & 0xff
-        key[5] = ~machine_number[2] & 0xff
-        key[6] = ~eeprom_uid[6] & 0xff
-        key[7] = ~machine_number[6] & 0xff
-        key[8] = ~machine_number[7] & 0xff
-        key[9] = ~eeprom_uid[1] & 0xff
-        key[10] = ~machine_number[3] & 0xff
-        key[11] = ~machine_number[1] & 0xff
-        key[12] = ~cartridge_key[7] & 0xff
-        key[13] = ~eeprom_uid[5] & 0xff
-        key[14] = ~cartridge_key[3] & 0xff
-        key[15] = ~cartridge_key[1] & 0xff
-
-        return key
-
+        return self.key_builder.build_key(cartridge_key, machine_number, eeprom_uid)
@@ -1,12 +1,21 @@
 import binascii
 import unittest
 
-from stratatools.manager import Manager
-from stratatools.crypto import Desx_Crypto
+from stratatools import layout
+from stratatools.cartridge import Cartridge_Record
+from stratatools.buffers import diff_ranges
+from stratatools.manager import Manager, eeprom_uid_variants
+from stratatools.crypto import Desx_Crypto, Desx_Batch_Crypto
+from stratatools.crypto_test import Backend_Cache_Fixture
 from stratatools.cartridge_pb2 import Cartridge
 from stratatools.checksum import Crc16_Checksum
 from google.protobuf.text_format import MessageToString, Merge
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 CARTRIDGE_TEXT = """
 serial_number: 1234.0
 material_name: "ABS_RED"
@@ -30,8 +39,11 @@ PACKED_CARTRIDGE_HEX = ("0000000000489340000000000000f03f35363738000000000000"
                         "4344dc2f00000000000000000040333336400000e8d400000000"
                         "544553545445535431")
 
+MACHINE_NUMBER = binascii.unhexlify("2C30478BB7DE81E8")
+EEPROM_UID = binascii.unhexlify("2362474d0100006b")
+
 
-class TestManager(unittest.TestCase):
+class TestManager(Backend_Cache_Fixture, unittest.TestCase):
     def test_pack(self):
         cartridge = Cartridge()
         Merge(CARTRIDGE_TEXT, cartridge)
@@ -54,4 +66,272 @@ class TestManager(unittest.TestCase):
         manager = Manager(crypto, checksum)
         unpacked_cartridge = manager.unpack(manager.pack(expected_cartridge))
 
-        assert expected_cartridge == unpacked_cartridge
+        assert isinstance(unpacked_cartridge, Cartridge_Record)
+        assert expected_cartridge == unpacked_cartridge.to_proto()
+        assert Cartridge_Record.from_proto(expected_cartridge) == unpacked_cartridge
+
+    def test_encode_decode(self):
+        expected_cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, expected_cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        eeprom = manager.encode(MACHINE_NUMBER, EEPROM_UID, expected_cartridge)
+
+        assert bytearray(binascii.unhexlify(PACKED_CARTRIDGE_HEX)) != eeprom
+        assert expected_cartridge == manager.decode(MACHINE_NUMBER, EEPROM_UID, eeprom).to_proto()
+
+    def test_encode_decode_out(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        expected_eeprom = manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge)
+
+        eeprom = bytearray(b"\xff" * 512)
+        assert manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge, out=memoryview(eeprom)) is not None
+        assert eeprom[0:0x71] == expected_eeprom
+        assert eeprom[0x71:] == b"\xff" * (512 - 0x71)
+
+        # Without out, the input is left untouched
+        crypted = bytes(eeprom)
+        packed = manager.decrypt(MACHINE_NUMBER, EEPROM_UID, eeprom)
+        assert bytes(eeprom) == crypted
+        assert packed[0:0x40] == manager.pack(cartridge)[0:0x40]
+
+        plaintext = bytearray(512)
+        assert manager.decode(MACHINE_NUMBER, EEPROM_UID, memoryview(eeprom), out=plaintext).to_proto() == cartridge
+        assert plaintext[0:0x40] == manager.pack(cartridge)[0:0x40]
+
+        manager.decrypt(MACHINE_NUMBER, EEPROM_UID, eeprom, out=eeprom)
+        assert eeprom[0:0x40] == manager.pack(cartridge)[0:0x40]
+
+    def test_encode_decode_into(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        expected_eeprom = manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge)
+
+        for i in range(8):
+            eeprom = manager.encode_into(MACHINE_NUMBER, EEPROM_UID, cartridge)
+            assert len(eeprom) == 512
+            assert eeprom[0:0x71] == expected_eeprom
+            assert eeprom[0x71:] == bytearray(512 - 0x71)
+
+            assert manager.decode_into(MACHINE_NUMBER, EEPROM_UID, eeprom).to_proto() == cartridge
+            manager.release(eeprom)
+
+        # Steady state, the same two buffers are reused
+        assert manager.pool.allocated == 2
+
+    def test_decode_wrong_machine(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        eeprom = manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge)
+
+        self.assertRaises(Exception, manager.decode, binascii.unhexlify("5394D7657CED641D"), EEPROM_UID, eeprom)
+
+    def test_record(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        record = Cartridge_Record.from_proto(cartridge)
+        assert record.key_fragment == b"ABCDABCD"
+        assert layout.unpack_date(record.last_use_date) == cartridge.last_use_date.ToDatetime()
+        assert record.to_proto() == cartridge
+        assert Cartridge_Record() != record
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        assert manager.pack(record) == manager.pack(cartridge)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_decode_columns(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        images = bytearray()
+        for quantity in [1.5, 2.5, 3.5]:
+            cartridge.current_material_quantity = quantity
+            image = manager.pack(cartridge)
+            images += image + bytearray(0x80 - len(image))
+        images[0x80 + 0x00] ^= 0xff
+
+        (records, valid) = manager.decode_columns(images, 0x80)
+
+        assert list(valid) == [True, False, True]
+        assert list(records.current_material_quantity) == [1.5, 2.5, 3.5]
+        assert records.manufacturing_lot[0] == b"5678"
+        assert records.key_fragment[2].tobytes() == b"ABCDABCD"
+
+        record = manager.unpack(images[0:0x71])
+        assert records.material_id[0] == 1.0
+        assert "material_name" not in records.dtype.names
+        assert records.last_use_date[0] == record.last_use_date
+        assert layout.unpack_dates(records.last_use_date)[0].item() == layout.unpack_date(record.last_use_date)
+
+        records.version[2] = 2
+        assert images[0x100 + 0x24] == 2
+
+        # Binary strings keep their trailing zeros
+        images[0x48:0x50] = b"AB\x00\x00\x00\x00\x00\x00"
+        assert records.key_fragment[0].tobytes() == b"AB\x00\x00\x00\x00\x00\x00"
+
+    def test_layout_regions(self):
+        content = layout.CARTRIDGE.compiled["content"]
+
+        assert content.struct.size == 0x40
+        assert content.names[0] == "serial_number"
+        assert layout.CARTRIDGE.fields["current_material_quantity"].region == "quantity"
+
+    def test_encode_decode_many(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        encoded = list(manager.encode_many([(MACHINE_NUMBER, EEPROM_UID, cartridge)] * 3))
+
+        assert [result.error for result in encoded] == [None] * 3
+
+        eeprom = bytes(encoded[0].value)
+        corrupted = bytearray(eeprom)
+        corrupted[0x00] ^= 0xff
+
+        decoded = list(manager.decode_many([
+            (MACHINE_NUMBER, EEPROM_UID, eeprom),
+            (MACHINE_NUMBER, EEPROM_UID, corrupted),
+            (MACHINE_NUMBER, EEPROM_UID, eeprom)]))
+
+        assert decoded[0].value.to_proto() == cartridge
+        assert decoded[1].value is None
+        assert "checksum" in str(decoded[1].error)
+        assert decoded[2].value.to_proto() == cartridge
+        assert eeprom == bytes(encoded[0].value)
+
+    def test_view(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        eeprom = bytes(manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge))
+
+        view = manager.view(MACHINE_NUMBER, EEPROM_UID, eeprom)
+        assert view.key_fragment == b"ABCDABCD"
+        assert view.decrypted == set()
+        assert view.current_material_quantity == cartridge.current_material_quantity
+        assert view.decrypted == set(["quantity"])
+        assert view.material_name == "ABS_RED"
+        assert view.decrypted == set(["quantity", "content"])
+        assert view.to_proto() == cartridge
+        assert bytes(manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge)) == eeprom
+
+        self.assertRaises(AttributeError, getattr, view, "color")
+
+        wrong_machine = manager.view(binascii.unhexlify("0000000000000000"), EEPROM_UID, eeprom)
+        # A failure leaves the view as it was, reading again fails the same way
+        for i in range(2):
+            try:
+                wrong_machine.material_name
+                assert False
+            except Exception as e:
+                assert str(e).startswith("invalid content checksum"), str(e)
+        self.assertRaises(Exception, wrong_machine.to_record)
+        assert wrong_machine.decrypted == set(["content"])
+
+    def test_patch_quantity(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        eeprom = manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge)
+
+        changes = manager.patch_quantity(MACHINE_NUMBER, EEPROM_UID, eeprom, 11.5)
+
+        for (start, end) in changes:
+            assert 0x58 <= start and end <= 0x64
+
+        cartridge.current_material_quantity = 11.5
+        assert manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge) == eeprom
+        assert manager.patch_quantity(MACHINE_NUMBER, EEPROM_UID, eeprom, 11.5) == []
+
+    def test_patch_fields(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        eeprom = manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge)
+        original = bytearray(eeprom)
+
+        changes = manager.patch(MACHINE_NUMBER, EEPROM_UID, eeprom, {"key_fragment": binascii.unhexlify("0102030405060708"), "manufacturing_lot": "4321"})
+
+        assert changes == diff_ranges(original, eeprom)
+        assert "4321" == manager.read_field(MACHINE_NUMBER, EEPROM_UID, eeprom, "manufacturing_lot")
+
+        cartridge.key_fragment = b"0102030405060708"
+        cartridge.manufacturing_lot = "4321"
+        assert cartridge == manager.decode(MACHINE_NUMBER, EEPROM_UID, eeprom).to_proto()
+
+        self.assertRaises(Exception, manager.patch, MACHINE_NUMBER, EEPROM_UID, eeprom, {"color": "red"})
+
+    def test_patch_checksums(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        manager = Manager(Desx_Crypto(), Crc16_Checksum())
+        checksum = Crc16_Checksum()
+
+        for fields in [{"current_material_quantity": 3.25}, {"manufacturing_lot": "4321"}, {"key_fragment": binascii.unhexlify("0102030405060708")}]:
+            eeprom = manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge)
+            manager.patch(MACHINE_NUMBER, EEPROM_UID, eeprom, fields)
+
+            # The patched checksums are the ones computed over the whole regions
+            decrypted = bytearray(eeprom)
+            key = manager._get_key(MACHINE_NUMBER, EEPROM_UID, decrypted)
+            for region in manager.layout.regions.values():
+                if region.crypted:
+                    assert layout.CRC.unpack_from(eeprom, region.crypted_crc)[0] == checksum.checksum(eeprom[region.start:region.end])
+                    manager.crypto.decrypt(key, memoryview(decrypted)[region.start:region.end], out=memoryview(decrypted)[region.start:region.end])
+                if region.plain_crc is not None:
+                    assert layout.CRC.unpack_from(decrypted, region.plain_crc)[0] == checksum.checksum(decrypted[region.start:region.end])
+
+        # A stored checksum is only patched once validated
+        eeprom = manager.encode(MACHINE_NUMBER, EEPROM_UID, cartridge)
+        eeprom[0x50] ^= 0xff
+        self.assertRaises(Exception, manager.patch, MACHINE_NUMBER, EEPROM_UID, eeprom, {"key_fragment": binascii.unhexlify("0102030405060708")})
+
+    def test_eeprom_uid_variants(self):
+        variants = eeprom_uid_variants(EEPROM_UID)
+
+        assert variants[0] == EEPROM_UID
+        assert variants[1] == binascii.unhexlify("b362474d0100006b")
+        assert variants[2] == binascii.unhexlify("6b0000014d476223")
+        assert len(variants) == 3
+
+    def test_probe(self):
+        cartridge = Cartridge()
+        Merge(CARTRIDGE_TEXT, cartridge)
+
+        machines = [
+            ("prodigy", binascii.unhexlify("5394D7657CED641D")),
+            ("fox", MACHINE_NUMBER),
+            ("uprint", binascii.unhexlify("F3A91DBE6B0B2255"))]
+        reversed_uid = binascii.unhexlify("6b0000014d476223")
+
+        for crypto in [Desx_Crypto()] + ([Desx_Batch_Crypto()] if numpy is not None else []):
+            manager = Manager(crypto, Crc16_Checksum())
+
+            eeprom = manager.encode(MACHINE_NUMBER, reversed_uid, cartridge)
+            result = manager.probe(binascii.unhexlify("b362474d0100006b"), eeprom, machines, batch_size=2)
+            assert result.machine_type == "fox"
+            assert result.machine_number == MACHINE_NUMBER
+            assert manager.decode(result.machine_number, result.eeprom_uid, eeprom).to_proto() == cartridge
+
+            eeprom = manager.encode(binascii.unhexlify("0000000000000000"), EEPROM_UID, cartridge)
+            result = manager.probe(EEPROM_UID, eeprom, machines)
+            assert result.machine_type is None
+            assert result.tried == 6
+
+            eeprom[0] ^= 0xff
+            self.assertRaises(Exception, manager.probe, EEPROM_UID, eeprom, machines)
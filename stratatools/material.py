@@ -10,9 +10,26 @@
 # material and code in this project, 0x0F has the identifier ABS_S, while 0xA0 is given the identifier ABS_S_2.
 #
 
-id_to_name = ["unknown"] * 0x1000
-for i in range(0, 0x1000):
-    id_to_name[i] = "unknown_" + hex(i)[2:]
+import os
+
+#
+# Only the known materials are listed, any other identifier gets an
+# 'unknown_<hex id>' name built when it is looked up, and parsed back.
+# Identifiers are 12 bits, from 0 to MAX_ID.
+#
+# More materials can be loaded from a file with load_materials(), or from
+# the file named by the STRATATOOLS_MATERIALS environment variable the first
+# time a material is looked up. Each line holds an identifier and a name,
+# e.g. '0x1f5 M30_RED', lines starting with '#' are ignored.
+#
+
+MATERIALS_ENVIRONMENT_VARIABLE = "STRATATOOLS_MATERIALS"
+
+UNKNOWN_PREFIX = "unknown_"
+
+MAX_ID = 0xfff
+
+id_to_name = {}
 
 id_to_name[0x00] = "ABS"
 id_to_name[0x01] = "ABS_RED"
@@ -175,15 +192,77 @@ id_to_name[0x386] = "PC_S_2"
 id_to_name[0x387] = "ULT_S_2"
 id_to_name[0x388] = "SR35_2"
 
+name_to_id = dict((name, id) for (id, name) in id_to_name.items())
+
+environment_loaded = False
+
+def add_material(id, name):
+    if name.startswith(UNKNOWN_PREFIX):
+        raise Exception("material name <" + name + "> is reserved for unknown materials")
+    if id in id_to_name and id_to_name[id] != name:
+        raise Exception("material " + hex(id) + " is already named <" + id_to_name[id] + ">")
+    if name in name_to_id and name_to_id[name] != id:
+        raise Exception("material <" + name + "> already has the identifier " + hex(name_to_id[name]))
+
+    id_to_name[id] = name
+    name_to_id[name] = id
 
-name_to_id = {}
+def load_materials(f):
+    for (line_number, line) in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            (id, name) = line.split()
+            id = int(id, 0)
+        except ValueError:
+            raise Exception("line " + str(line_number) + ": expected an identifier and a name, got <" + line + ">")
+
+        add_material(id, name)
+
+def load_environment():
+    global environment_loaded
+
+    if environment_loaded:
+        return
+    environment_loaded = True
+
+    path = os.environ.get(MATERIALS_ENVIRONMENT_VARIABLE)
+    if path:
+        with open(path, "r") as f:
+            load_materials(f)
+
+#
+# Known materials, sorted by identifier
+#
+def get_materials():
+    load_environment()
+    return sorted(id_to_name.items())
 
 def get_name_from_id(id):
-    return id_to_name[id]
+    if id < 0 or id > MAX_ID:
+        raise Exception("material identifier " + str(id) + " is out of range")
+
+    load_environment()
+    try:
+        return id_to_name[id]
+    except KeyError:
+        return UNKNOWN_PREFIX + "%x" % id
 
 def get_id_from_name(name):
-    if len(name_to_id) == 0:
-        for key, value in enumerate(id_to_name):
-            name_to_id[value] = key
+    load_environment()
+    try:
+        return name_to_id[name]
+    except KeyError:
+        pass
+
+    if name.startswith(UNKNOWN_PREFIX):
+        try:
+            id = int(name[len(UNKNOWN_PREFIX):], 16)
+        except ValueError:
+            id = None
+        if id is not None and 0 <= id <= MAX_ID:
+            return id
 
-    return name_to_id[name]
+    raise Exception("unknown material <" + name + ">")
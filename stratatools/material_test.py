@@ -0,0 +1,40 @@
+import io
+import unittest
+from stratatools import material
+
+class TestMaterial(unittest.TestCase):
+    def test_known(self):
+        assert material.get_name_from_id(0x05) == "ABS_BLU"
+        assert material.get_id_from_name("ABS_BLU") == 0x05
+        assert material.get_id_from_name("ABS-M30_2") == 0x1f4
+
+        for (id, name) in material.get_materials():
+            assert material.get_id_from_name(material.get_name_from_id(id)) == id
+
+    def test_unknown(self):
+        assert material.get_name_from_id(0xfff) == "unknown_fff"
+        assert material.get_id_from_name("unknown_fff") == 0xfff
+        assert 0xfff not in material.id_to_name
+
+        self.assertRaises(Exception, material.get_id_from_name, "NOT_A_MATERIAL")
+        self.assertRaises(Exception, material.get_id_from_name, "unknown_xyz")
+
+    def test_out_of_range(self):
+        self.assertRaises(Exception, material.get_name_from_id, -1)
+        self.assertRaises(Exception, material.get_name_from_id, 0x1000)
+        self.assertRaises(Exception, material.get_id_from_name, "unknown_1000")
+        self.assertRaises(Exception, material.get_id_from_name, "unknown_-1")
+
+    def test_load_materials(self):
+        try:
+            material.load_materials(io.StringIO(u"# extra materials\n\n0xffe TEST_MATERIAL\n"))
+
+            assert material.get_name_from_id(0xffe) == "TEST_MATERIAL"
+            assert material.get_id_from_name("TEST_MATERIAL") == 0xffe
+        finally:
+            del material.id_to_name[0xffe]
+            del material.name_to_id["TEST_MATERIAL"]
+
+        self.assertRaises(Exception, material.load_materials, io.StringIO(u"0x05 ABS_BLUE\n"))
+        self.assertRaises(Exception, material.load_materials, io.StringIO(u"0xffe ABS_BLU\n"))
+        self.assertRaises(Exception, material.load_materials, io.StringIO(u"0xffe\n"))
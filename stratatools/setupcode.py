@@ -3,9 +3,17 @@
 #
 
 import argparse
+import collections
+import csv
+import multiprocessing
 import struct
 import sys
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Format
 # ------
 #   00  sn1
@@ -41,6 +49,41 @@ class Setupcode():
     def __init__(self):
         pass
 
+#
+# A row of a setup code batch, materials being a list of material names
+#
+Setupcode_Row = collections.namedtuple("Setupcode_Row", ["serial_number", "system_type", "envelope_size", "build_speed", "material", "version", "key"])
+
+#
+# Result of one row of a batch: the row and its setup code, or the error
+# that prevented it
+#
+Setupcode_Result = collections.namedtuple("Setupcode_Result", ["row", "code", "error"])
+
+#
+# The part of a configuration code that only depends on the serial number:
+# the seed code, the symbols of the 4 serial digits (positions 0, 6, 12 and
+# 18) and the _unnormalize_sn value added to the shift base
+#
+Serial_Part = collections.namedtuple("Serial_Part", ["seed_code", "sn_symbols", "sn_shift"])
+
+#
+# Setup codes decoded in batch
+#
+# codes: (N, 19) array of the unshifted code values, 0 for the separators
+# materials: (N,) array of the material bits
+# keys: (N,) array of the keys, the base shift of each code
+# status: (N,) array, one of the DECODE_* status below
+#
+Setupcode_Batch = collections.namedtuple("Setupcode_Batch", ["codes", "materials", "keys", "status"])
+
+DECODE_OK = 0
+DECODE_INVALID_CODE = 1
+DECODE_INVALID_CHECKSUM = 2
+DECODE_INVALID_FIELD = 3
+
+decode_status_names = ["ok", "invalid code", "invalid checksum", "invalid field"]
+
 class CodeMaterial():
     # Material is encoded on 32 bit
     id_to_material = ["unknown"] * 32
@@ -177,31 +220,119 @@ class SetupcodeEncoder():
     mod_seven_dict = [17,15,21,2,0,22,9,10,4,0,11,17,6,8,0,18,16,23,29]
     mod_eight_dict = [23,18,11,22,0,16,21,14,24,0,3,15,12,25,0,5,10,14,20]
     mod_nine_dict = [3,24,12,25,0,14,22,4,23,0,13,14,4,21,0,17,11,10,16]
+    mod_table = [mod_zero_dict, mod_one_dict, mod_two_dict, mod_three_dict, mod_four_dict, mod_five_dict, mod_six_dict, mod_seven_dict, mod_eight_dict, mod_nine_dict]
+
+    # Material bits held by each 5 bits material field of a code, lowest
+    # field bit first: abs, ppsf, iso and mat
+    material_fields = [
+        [0x01, 0x02, 0x04, 0x08, 0x200],
+        [0x10, 0x20, 0x40, 0x80, 0x100],
+        [0x400, 0x800, 0x1000, 0x2000, 0x4000],
+        [0x8000, 0x10000, 0x20000, 0x40000, 0x80000]]
+
+    # Every shift and unshift goes through a symbol position lower than 32
+    # and a shift value lower than 64
+    shift_values = 64
+
+    #
+    # Lookup tables, built once by _build_tables()
+    #
+    # symbol_position: position of a symbol, the first one for the symbols
+    #   found twice in the dictionary
+    # shift_table[value][position]: symbol of _do_shift(position, value)
+    # unshift_table[value][position]: _do_unshift(position, value)
+    # material_encode_table[byte][n]: material fields of the material byte
+    #   n, packed 5 bits per field
+    # material_decode_table[field][n]: material bits of the field value n
+    #
+    symbol_position = None
+    shift_table = None
+    unshift_table = None
+    material_encode_table = None
+    material_decode_table = None
+
+    # numpy versions of the tables, built on demand by _build_batch_tables()
+    batch_tables = None
+
+    @classmethod
+    def _build_tables(cls):
+        encoder = cls()
+
+        cls.symbol_position = {}
+        for (position, symbol) in enumerate(cls.dictionary[0:32]):
+            cls.symbol_position.setdefault(symbol, position)
+
+        cls.shift_table = [[cls.dictionary[encoder._do_shift(position, value)] for position in range(32)] for value in range(cls.shift_values)]
+        cls.unshift_table = [[encoder._do_unshift(position, value) for position in range(32)] for value in range(cls.shift_values)]
+
+        cls.material_encode_table = []
+        for byte in range(3):
+            table = [0] * 256
+            for n in range(256):
+                material = n << (8 * byte)
+                for (field, bits) in enumerate(cls.material_fields):
+                    for (field_bit, material_bit) in enumerate(bits):
+                        if material & material_bit:
+                            table[n] |= 1 << (5 * field + field_bit)
+            cls.material_encode_table.append(table)
+
+        cls.material_decode_table = []
+        for bits in cls.material_fields:
+            table = [0] * 32
+            for n in range(32):
+                for (field_bit, material_bit) in enumerate(bits):
+                    if n & (1 << field_bit):
+                        table[n] |= material_bit
+            cls.material_decode_table.append(table)
+
+    #
+    # symbol: position of each byte, 31 when not a symbol like
+    #   _dict_get_position
+    # key: position of each byte, -1 when not a symbol
+    #
+    @classmethod
+    def _build_batch_tables(cls):
+        if cls.batch_tables is not None:
+            return cls.batch_tables
+
+        symbol = numpy.full(256, 31, dtype=numpy.int64)
+        key = numpy.full(256, -1, dtype=numpy.int64)
+        for (value, position) in cls.symbol_position.items():
+            symbol[ord(value)] = position
+            key[ord(value)] = position
+
+        cls.batch_tables = {
+            "symbol": symbol,
+            "key": key,
+            "magic_shift": numpy.array(cls.magic_shift, dtype=numpy.int64),
+            "unshift": numpy.array(cls.unshift_table, dtype=numpy.int64),
+            "material": numpy.array(cls.material_decode_table, dtype=numpy.int64),
+            "checksum": numpy.array([0, 1, 2, 3, 5, 6, 10, 11, 12, 13, 15, 16, 18]),
+        }
+        return cls.batch_tables
+
+    #
+    # With precompute_serials, the Serial_Part of the 10000 4 digits serial
+    # numbers are computed once, for encoders making many codes
+    #
+    def __init__(self, precompute_serials=False):
+        self.serial_parts = None
+        if precompute_serials:
+            self.serial_parts = [self._serial_part("%04d" % n) for n in range(10000)]
+
+    def _serial_part(self, serial_number):
+        if self.serial_parts is not None and len(serial_number) == 4 and serial_number.isdigit():
+            return self.serial_parts[int(serial_number)]
+
+        seed_code = self._randomize_code(int(serial_number))
+        sn_symbols = tuple(self._encode_param(seed_code[position], int(serial_number[digit]), 0x1F) for (digit, position) in enumerate([0, 6, 12, 18]))
+        # Both code type branches of _unnormalize_sn are the same
+        return Serial_Part(seed_code, sn_symbols, self._unnormalize_sn(serial_number, 0))
 
     def _randomize_code(self, serial_number):
         serial_code = [0] * 19
 
-        mod_dict = []
-        if (serial_number % 10 == 0x00):
-            mod_dict = self.mod_zero_dict
-        elif (serial_number % 10 == 0x01):
-            mod_dict = self.mod_one_dict
-        elif (serial_number % 10 == 0x02):
-            mod_dict = self.mod_two_dict
-        elif (serial_number % 10 == 0x03):
-            mod_dict = self.mod_three_dict
-        elif (serial_number % 10 == 0x04):
-            mod_dict = self.mod_four_dict
-        elif (serial_number % 10 == 0x05):
-            mod_dict = self.mod_five_dict
-        elif (serial_number % 10 == 0x06):
-            mod_dict = self.mod_six_dict
-        elif (serial_number % 10 == 0x07):
-            mod_dict = self.mod_seven_dict
-        elif (serial_number % 10 == 0x08):
-            mod_dict = self.mod_eight_dict
-        elif (serial_number % 10 == 0x09):
-            mod_dict = self.mod_nine_dict
+        mod_dict = self.mod_table[serial_number % 10]
 
         for i in range(19):
             serial_code[i] = self.dictionary[mod_dict[i]]
@@ -214,14 +345,15 @@ class SetupcodeEncoder():
     def encode(self, serial_number, system_type, envelope_size, build_speed, material, code_type, version, key):
         output_code = ["\x00"] * 19
 
-        seed_code = self._randomize_code(int(serial_number))
+        serial_part = self._serial_part(serial_number)
+        seed_code = serial_part.seed_code
 
         material_id = self._material_id_from_names(material)
         (m_abs, m_ppsf, m_iso, mat) = self._encode_material(material_id)
 
         if code_type == "configuration":
             # sn 1
-            output_code[0] = self._encode_param(seed_code[0], int(serial_number[0]), 0x1F)
+            output_code[0] = serial_part.sn_symbols[0]
             # system type
             output_code[1] = self._encode_param(seed_code[1], SystemType.to_id(system_type) & 0x1F, 0x0F)
             # envelope size
@@ -232,7 +364,7 @@ class SetupcodeEncoder():
             # material (abs)
             output_code[5] = self._encode_param(seed_code[5], int(m_abs) & 0x1F, 0x1F)
             # sn 2
-            output_code[6] = self._encode_param(seed_code[6], int(serial_number[1]), 0x1F)
+            output_code[6] = serial_part.sn_symbols[1]
             # checksum 1
             #output_code[7]
             # checksum 2
@@ -243,7 +375,7 @@ class SetupcodeEncoder():
             # material (iso)
             output_code[11] = self._encode_param(seed_code[11], int(m_iso) & 0x1F, 0x1F)
             # sn 3
-            output_code[12] = self._encode_param(seed_code[12], int(serial_number[2]), 0x1F)
+            output_code[12] = serial_part.sn_symbols[2]
             # version
             output_code[13] = self._encode_param(seed_code[13], int(version) & 0x1F, 0x03)
             output_code[14] = "-"
@@ -254,7 +386,7 @@ class SetupcodeEncoder():
             # key
             #output_code[17]
             # sn4
-            output_code[18] = self._encode_param(seed_code[18], int(serial_number[3]), 0x1F)
+            output_code[18] = serial_part.sn_symbols[3]
         elif code_type == "clear":
             raise(Exception("code_type `clear` not supported"))
         elif code_type == "setup":
@@ -263,8 +395,8 @@ class SetupcodeEncoder():
             raise(Exception("invalid code_type <" + code_type + ">"))
 
         checksum = self._checksum_compose(output_code)
-        output_code[7] = self.dictionary[self._do_shift(0, (checksum >> 4) & 0xF)]
-        output_code[8] = self.dictionary[self._do_shift(0, checksum & 0xF)]
+        output_code[7] = self.shift_table[(checksum >> 4) & 0xF][0]
+        output_code[8] = self.shift_table[checksum & 0xF][0]
 
         setup_code = self._shift_code(output_code,
                 serial_number,
@@ -273,7 +405,8 @@ class SetupcodeEncoder():
                 BuildSpeed.to_id(build_speed),
                 int(material_id),
                 CodeType.to_id(code_type),
-                key)
+                key,
+                serial_part.sn_shift)
 
         return "".join(setup_code)
 
@@ -303,20 +436,79 @@ class SetupcodeEncoder():
         s.version = str(code[13] & 0x03)
         s.material = self._get_enabled_material(self._decode_material(code)) + "(" + str(self._decode_material(code)) + ")"
         s.code_type = CodeType.from_id(code[15] & 0x03)
-        s.key = str(self.dictionary.index(setup_code[17]))
+        s.key = str(self.symbol_position[setup_code[17]])
 
         return s
 
-    def _get_enabled_material(self, material):
-        supported_material = ""
-        counter = 0
-        i=1
+    #
+    # Decode a list of setup codes at once, returning a Setupcode_Batch
+    #
+    # Each code gets a status instead of an exception: DECODE_INVALID_CODE
+    # when decode() would fail with "invalid code", DECODE_INVALID_CHECKSUM
+    # for a bad checksum and DECODE_INVALID_FIELD when an envelope size or a
+    # build speed is out of range. Codes are stripped of the surrounding
+    # whitespace.
+    #
+    def decode_batch(self, setup_codes):
+        if numpy is None:
+            raise Exception("numpy is required to decode setup codes in batch")
+
+        tables = self._build_batch_tables()
+
+        setup_codes = [code.strip() for code in setup_codes]
+        count = len(setup_codes)
+        if count == 0:
+            return Setupcode_Batch(numpy.zeros((0, 19), dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int8))
+
+        # Only the first 19 characters are used, like decode()
+        raw = b"".join(code[0:19].ljust(19).encode("latin-1", "replace") if not isinstance(code, bytes) else code[0:19].ljust(19) for code in setup_codes)
+        raw = numpy.frombuffer(raw, dtype=numpy.uint8).reshape(count, 19)
+
+        status = numpy.zeros(count, dtype=numpy.int8)
+
+        base_shift = tables["key"][raw[:, 17]]
+        invalid = (base_shift < 0) | (numpy.array([len(code) for code in setup_codes]) < 19)
+        base_shift[invalid] = 0
+
+        codes = tables["unshift"][base_shift[:, None] + tables["magic_shift"], tables["symbol"][raw]]
+        codes[:, [4, 9, 14]] = 0
+
+        expected_checksum = 16 * codes[:, 7] + codes[:, 8]
+        checksum = codes[:, tables["checksum"]].sum(axis=1)
+
+        materials = tables["material"][0][codes[:, 5] & 0x1f] | tables["material"][1][codes[:, 10] & 0x1f]
+        extended = (codes[:, 13] & 0x03) > 1
+        materials |= numpy.where(extended, tables["material"][2][codes[:, 11] & 0x1f] | tables["material"][3][codes[:, 16] & 0x1f], 0)
+
+        status[((codes[:, 2] & 0x03) == 0x03) | ((codes[:, 3] & 0x03) == 0x03)] = DECODE_INVALID_FIELD
+        status[expected_checksum != checksum] = DECODE_INVALID_CHECKSUM
+        status[invalid] = DECODE_INVALID_CODE
+
+        return Setupcode_Batch(codes, materials, base_shift, status)
+
+    #
+    # Setupcode of a valid code of a Setupcode_Batch, like decode()
+    #
+    def batch_setupcode(self, batch, index):
+        code = [int(value) for value in batch.codes[index]]
+        material = int(batch.materials[index])
 
-        while i <= 2**32:
-            if material & i:
-                supported_material += CodeMaterial.from_id(counter) + " "
-            i <<= 1
-            counter+=1
+        s = Setupcode()
+        s.serial_number = "".join(str(c) for c in [code[0], code[6], code[12], code[18]])
+        s.system_type = SystemType.from_id(code[1] & 0x0F)
+        s.envelope_size = EnvelopeSize.from_id(code[2] & 0x03)
+        s.build_speed = BuildSpeed.from_id(code[3] & 0x03)
+        s.checksum_1 = str(code[7])
+        s.checksum_2 = str(code[8])
+        s.version = str(code[13] & 0x03)
+        s.material = self._get_enabled_material(material) + "(" + str(material) + ")"
+        s.code_type = CodeType.from_id(code[15] & 0x03)
+        s.key = str(int(batch.keys[index]))
+
+        return s
+
+    def _get_enabled_material(self, material):
+        supported_material = "".join(CodeMaterial.from_id(i) + " " for i in range(33) if material & (1 << i))
 
         # Another version found:
 
@@ -342,55 +534,16 @@ class SetupcodeEncoder():
         return material_id
 
     def _encode_material(self, material):
-        mat_abs = material & 0x01
-        mat_abs |= material & 0x02
-        mat_abs |= material & 0x04
-        mat_abs |= material & 0x08
-        if material & 0x200:
-            mat_abs |= 0x10
-
-        mat_ppsf = 0
-        if material & 0x10:
-            mat_ppsf |= 0x01
-        if material & 0x20:
-            mat_ppsf |= 0x02
-        if material & 0x40:
-            mat_ppsf |= 0x04
-        if material & 0x80:
-            mat_ppsf |= 0x08
-        if material & 0x100:
-            mat_ppsf |= 0x10
-
-        mat_iso = 0
-        if material & 0x400:
-            mat_iso |= 0x01
-        if material & 0x800:
-            mat_iso |= 0x02
-        if material & 0x1000:
-            mat_iso |= 0x04
-        if material & 0x2000:
-            mat_iso |= 0x08
-        if material & 0x4000:
-            mat_iso |= 0x10
-
-        mat = 0
-        if material & 0x8000:
-            mat |= 0x01
-        if material & 0x10000:
-            mat |= 0x02
-        if material & 0x20000:
-            mat |= 0x04
-        if material & 0x40000:
-            mat |= 0x08
-        if material & 0x80000:
-            mat |= 0x10
-
-        return (mat_abs, mat_ppsf, mat_iso, mat)
+        fields = self.material_encode_table[0][material & 0xff]
+        fields |= self.material_encode_table[1][(material >> 8) & 0xff]
+        fields |= self.material_encode_table[2][(material >> 16) & 0xff]
+
+        return (fields & 0x1f, (fields >> 5) & 0x1f, (fields >> 10) & 0x1f, (fields >> 15) & 0x1f)
 
     def _encode_param(self, code, value, notv):
         return self.dictionary[(~notv & self._dict_get_position(code) & 0x1F) | value]
 
-    def _shift_code(self, setup_code, serial_number, system_type, envelope_size, build_speed, material, code_type, key):
+    def _shift_code(self, setup_code, serial_number, system_type, envelope_size, build_speed, material, code_type, key, sn_shift=None):
         # Get the shift base value
 
         # Algorithm 1
@@ -410,7 +563,9 @@ class SetupcodeEncoder():
         shift_base = (shift_base + self.envelope_size_dict[envelope_size]) & 0xff
         shift_base = (shift_base + self.code_type_dict[code_type]) & 0xfF
         shift_base = (shift_base + self.system_type_dict[system_type]) & 0xff
-        shift_base = (shift_base + self._unnormalize_sn(serial_number, code_type)) & 0xff
+        if sn_shift is None:
+            sn_shift = self._unnormalize_sn(serial_number, code_type)
+        shift_base = (shift_base + sn_shift) & 0xff
 
         if int(serial_number) & 1:
             shift_base += 4
@@ -423,30 +578,37 @@ class SetupcodeEncoder():
             shift_base = (shift_base - 0x20) & 0xff
             error = error + 1
             if error > 5 :
-                raise "error > 5 :("
+                raise(Exception("invalid shift base <" + str(shift_base) + ">, key too large"))
 
         for i in [0, 1, 2, 3, 5, 6, 7, 8, 10, 11, 12, 13, 15, 16, 18]:
             position = self._dict_get_position(setup_code[i])
-            shift = self._do_shift(position, shift_base + self.magic_shift[i])
-            setup_code[i] = self.dictionary[shift]
+            setup_code[i] = self._shift_symbol(position, shift_base + self.magic_shift[i])
 
-        setup_code[17] = self.dictionary[self._do_shift(0, shift_base)]
+        setup_code[17] = self._shift_symbol(0, shift_base)
 
         return setup_code
 
     def _unshift_code(self, input_code):
         new_code = [0x00] * 19
-        base_shift = self.dictionary.index(input_code[17])
+        base_shift = self.symbol_position[input_code[17]]
 
         for i in [0, 1, 2, 3, 5, 6, 7, 8, 10, 11, 12, 13, 15, 16, 17, 18]:
             position = self._dict_get_position(input_code[i])
-            new_code[i] = self._do_unshift(position, base_shift + self.magic_shift[i])
+            new_code[i] = self.unshift_table[base_shift + self.magic_shift[i]][position]
 
         for i in [4, 9, 14]:
             new_code[i] = "-"
 
         return new_code
 
+    #
+    # Symbol of the shifted position, from the table when the value is in it
+    #
+    def _shift_symbol(self, position, value):
+        if 0 <= value < self.shift_values:
+            return self.shift_table[value][position]
+        return self.dictionary[self._do_shift(position, value)]
+
     def _do_shift(self, position, value):
         if value > 0x20:
             value = (value % 10) & 0xFF
@@ -477,46 +639,17 @@ class SetupcodeEncoder():
         return checksum
 
     def _decode_material(self, code):
-        material = ((code[5] & 0x01) + (code[5] & 0x02) + (code[5] & 0x04) + (code[5] & 0x08))
-        if code[5] & 0x10:
-            material |= 0x200
-
-        material |= ((code[10] & 0x1) + (code[10] & 0x02) + (code[10] & 0x04) + (code[10] & 0x08) + (code[10] & 0x10)) << 0x04
+        material = self.material_decode_table[0][code[5] & 0x1f]
+        material |= self.material_decode_table[1][code[10] & 0x1f]
 
         if (code[13] & 0x03) > 1:
-            if code[11] & 0x01:
-                material |= 0x400
-            if code[11] & 0x02:
-                material |= 0x800
-            if code[11] & 0x04:
-                material |= 0x1000
-            if code[11] & 0x08:
-                material |= 0x2000
-            if code[11] & 0x10:
-                material |= 0x4000
-
-            if code[16] & 0x01:
-                material |= 0x8000
-            if code[16] & 0x02:
-                material |= 0x10000
-            if code[16] & 0x04:
-                material |= 0x20000
-            if code[16] & 0x08:
-                material |= 0x40000
-            if code[16] & 0x10:
-                material |= 0x80000
+            material |= self.material_decode_table[2][code[11] & 0x1f]
+            material |= self.material_decode_table[3][code[16] & 0x1f]
 
         return material
 
     def _dict_get_position(self, value):
-        try:
-            position = self.dictionary.index(value)
-            if position > 31:
-                position = 31
-        except:
-            position = 31
-
-        return position
+        return self.symbol_position.get(value, 31)
 
     def _unnormalize_sn(self, sn, code_type):
         sn_length = len(sn.lstrip("0"))
@@ -554,3 +687,87 @@ class SetupcodeEncoder():
 
         return value
 
+SetupcodeEncoder._build_tables()
+
+#
+# Encode a batch of setup codes, yielding one Setupcode_Result per row, in
+# order
+#
+# rows are Setupcode_Row, e.g. from read_setupcode_rows(), Setupcode_Result
+# items of rows that could not be read are passed through. The rows are
+# spread over a pool of processes (one per CPU by default), each one with
+# its own encoder holding the Serial_Part of every 4 digits serial number.
+# processes=1 encodes in this process.
+#
+def encode_batch(rows, code_type="configuration", processes=None, chunksize=256):
+    rows = ((row, code_type) for row in rows)
+
+    if processes == 1:
+        encoder = SetupcodeEncoder(precompute_serials=True)
+        for (row, code_type) in rows:
+            yield _encode_row(encoder, row, code_type)
+        return
+
+    pool = multiprocessing.Pool(processes, _init_batch_worker)
+    try:
+        for result in pool.imap(_encode_batch_row, rows, chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+# Encoder of a pool worker process
+batch_encoder = None
+
+def _init_batch_worker():
+    global batch_encoder
+
+    batch_encoder = SetupcodeEncoder(precompute_serials=True)
+
+def _encode_batch_row(item):
+    (row, code_type) = item
+    return _encode_row(batch_encoder, row, code_type)
+
+def _encode_row(encoder, row, code_type):
+    if isinstance(row, Setupcode_Result):
+        return row
+
+    try:
+        code = encoder.encode(row.serial_number, row.system_type, row.envelope_size, row.build_speed, row.material, code_type, row.version, row.key)
+        return Setupcode_Result(row, code, None)
+    except Exception as e:
+        return Setupcode_Result(row, None, str(e))
+
+#
+# Read Setupcode_Row from CSV lines:
+#
+#   serial_number,system_type,envelope_size,build_speed,materials,version[,key]
+#   1234,900mc,large,1x,ABS-M30 NYLON PC-ABS,1,0
+#
+# Serial numbers have 4 digits, materials are separated by spaces, key
+# defaults to 0. Empty lines, lines starting with '#' and a 'serial_number'
+# header are skipped. A line that cannot be read gives a Setupcode_Result
+# without row nor code, with the error, and reading goes on.
+#
+def read_setupcode_rows(f):
+    for (line_number, fields) in enumerate(csv.reader(f), 1):
+        if not fields or fields[0].startswith("#") or fields[0] == "serial_number":
+            continue
+
+        if len(fields) not in (6, 7):
+            yield Setupcode_Result(None, None, "line " + str(line_number) + ": expected 6 or 7 fields, got " + str(len(fields)))
+            continue
+
+        fields = [field.strip() for field in fields]
+        if len(fields[0]) != 4 or not fields[0].isdigit():
+            yield Setupcode_Result(None, None, "line " + str(line_number) + ": invalid serial number <" + fields[0] + ">")
+            continue
+
+        try:
+            key = int(fields[6]) if len(fields) == 7 and fields[6] else 0
+        except ValueError:
+            yield Setupcode_Result(None, None, "line " + str(line_number) + ": invalid key <" + fields[6] + ">")
+            continue
+
+        yield Setupcode_Row(fields[0], fields[1], fields[2], fields[3], fields[4].split(), fields[5], key)
@@ -0,0 +1,118 @@
+import io
+import unittest
+from stratatools import setupcode
+from stratatools.setupcode import SetupcodeEncoder, Setupcode_Result, Setupcode_Row, encode_batch, read_setupcode_rows
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# (serial number, system type, envelope size, build speed, materials, code type, version, key), code
+ENCODED = [
+    (("0008", "900mc", "small", "1x", [], "configuration", "2", 0), "SR6L-UW32-SUTQ-4TR8"),
+    (("0015", "titan_ti", "large", "ti", ["NYLON"], "configuration", "1", 0), "2CTK-468J-254R-M3XB"),
+    (("0044", "vantage_i_pc", "small", "1x", ["PC-ABS", "ASA"], "configuration", "2", 0), "U9GX-244G-U43E-GVT8"),
+    (("9999", "360mc", "small", "ti", ["PC", "ULT1010", "PC-ABS", "ABS", "ABS-M30", "ULT9085", "ABSI", "ABS-M30I", "ABS-ESD7", "ASA", "PC-ISO", "PPSF", "NYLON"], "configuration", "3", 42), "KCP9-CZPS-AQL6-VCAZ"),
+    (("1234", "vantage_i_pc", "invalid", "ti", ["PPSF", "ASA", "PC-ABS", "ULT9085", "ABS-M30I", "NYLON", "ABSI", "ABS", "ULT1010", "ABS-ESD7", "PC-ISO", "PC", "RD1-RD2-RD3-RD4-RD5"], "configuration", "2", 30), "WCG3-27A8-SY3F-HWU9"),
+]
+
+class TestSetupcode(unittest.TestCase):
+    def test_encode(self):
+        for encoder in [SetupcodeEncoder(), SetupcodeEncoder(precompute_serials=True)]:
+            for (args, expected_code) in ENCODED:
+                assert encoder.encode(*args) == expected_code, args
+
+    def test_decode(self):
+        encoder = SetupcodeEncoder()
+
+        s = encoder.decode("U9GX-244G-U43E-GVT8")
+        assert s.serial_number == "0044"
+        assert s.system_type == "vantage_i_pc"
+        assert s.envelope_size == "small"
+        assert s.build_speed == "1x"
+        assert s.version == "2"
+        assert s.material == "PC-ABS ASA (4098)"
+        assert s.code_type == "configuration"
+        assert s.key == "29"
+
+        s = encoder.decode("WCG3-27A8-SY3F-HWU9")
+        assert s.material == "ABS PC-ABS PC PC-ISO PPSF ABSI ABS-M30I ULT9085 ABS-ESD7 NYLON RD1-RD2-RD3-RD4-RD5 ASA ULT1010 (16351)"
+        assert s.key == "30"
+
+    def test_decode_invalid(self):
+        encoder = SetupcodeEncoder()
+
+        self.assertRaises(Exception, encoder.decode, "U9GX-244G-U43E-GVT9")
+        self.assertRaises(Exception, encoder.decode, "U9GX-244G-U43E-GV1O")
+        self.assertRaises(Exception, encoder.decode, "U9GX")
+
+    def test_key_too_large(self):
+        encoder = SetupcodeEncoder()
+
+        self.assertRaises(Exception, encoder.encode, "0008", "900mc", "small", "1x", [], "configuration", "2", 200)
+
+    def test_tables(self):
+        encoder = SetupcodeEncoder()
+
+        for value in range(SetupcodeEncoder.shift_values):
+            for position in range(32):
+                assert encoder.shift_table[value][position] == encoder.dictionary[encoder._do_shift(position, value)]
+                assert encoder.unshift_table[value][position] == encoder._do_unshift(position, value)
+
+        # Symbols found twice in the dictionary take their first position
+        for symbol in "WXYZ":
+            assert encoder._dict_get_position(symbol) == encoder.dictionary.index(symbol)
+        assert encoder._dict_get_position("-") == 31
+
+        for material in [0, 1, 0x200, 0x3ff, 0x4001, 0xfffff, 0x12345]:
+            fields = encoder._encode_material(material)
+            code = [0] * 19
+            (code[5], code[10], code[11], code[16]) = fields
+            code[13] = 2
+            assert encoder._decode_material(code) == material & 0xfffff
+
+    def test_read_setupcode_rows(self):
+        rows = list(read_setupcode_rows(io.StringIO(u"serial_number,system_type,envelope_size,build_speed,materials,version,key\n# comment\n\n0044,vantage_i_pc,small,1x,PC-ABS ASA,2\n9999, 360mc ,small,ti,,3,42\n")))
+
+        assert rows == [
+            Setupcode_Row("0044", "vantage_i_pc", "small", "1x", ["PC-ABS", "ASA"], "2", 0),
+            Setupcode_Row("9999", "360mc", "small", "ti", [], "3", 42)]
+
+        # Bad lines are reported and reading goes on
+        rows = list(read_setupcode_rows(io.StringIO(u"0044,vantage_i_pc,small\nbad,row\n0044,vantage_i_pc,small,1x,ABS,2,k\n12,vantage_i_pc,small,1x,,2\n0044,vantage_i_pc,small,1x,,2\n")))
+
+        assert [row.error for row in rows[0:4]] == ["line 1: expected 6 or 7 fields, got 3", "line 2: expected 6 or 7 fields, got 2", "line 3: invalid key <k>", "line 4: invalid serial number <12>"]
+        assert rows[0].row is None and rows[0].code is None
+        assert rows[4] == Setupcode_Row("0044", "vantage_i_pc", "small", "1x", [], "2", 0)
+
+    def test_encode_batch(self):
+        rows = [Setupcode_Row(*(args[0:5] + args[6:8])) for (args, code) in ENCODED]
+        rows.append(Setupcode_Row("0008", "900mc", "small", "1x", ["NOT-A-MATERIAL"], "2", 0))
+        rows.append(Setupcode_Result(None, None, "line 7: invalid key <k>"))
+        expected = [code for (args, code) in ENCODED] + [None, None]
+
+        for processes in [1, 2]:
+            results = list(encode_batch(iter(rows), processes=processes, chunksize=2))
+
+            assert [result.code for result in results] == expected
+            assert [result.row for result in results[:-1]] == rows[:-1]
+            assert results[-2].error is not None
+            assert results[-1] == rows[-1]
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_decode_batch(self):
+        encoder = SetupcodeEncoder()
+        setup_codes = [code for (args, code) in ENCODED] + ["U9GX-244G-U43E-GVT9", "U9GX-244G-U43E-GV-8", "U9GX", " SR6L-UW32-SUTQ-4TR8\n"]
+
+        batch = encoder.decode_batch(setup_codes)
+
+        assert batch.codes.shape == (len(setup_codes), 19)
+        assert list(batch.status) == [setupcode.DECODE_OK] * len(ENCODED) + [setupcode.DECODE_INVALID_CHECKSUM, setupcode.DECODE_INVALID_CODE, setupcode.DECODE_INVALID_CODE, setupcode.DECODE_OK]
+
+        for (i, (args, code)) in enumerate(ENCODED):
+            expected = encoder.decode(code)
+            s = encoder.batch_setupcode(batch, i)
+            assert vars(s) == vars(expected), code
+
+        assert encoder.decode_batch([]).codes.shape == (0, 19)